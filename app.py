@@ -1,12 +1,39 @@
-from flask import Flask, render_template, request, send_from_directory, redirect, url_for, flash
+from flask import Flask, render_template, request, send_from_directory, redirect, url_for, flash, g, session, make_response
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from docx import Document
-from docx.shared import Inches, RGBColor, Pt
+from PIL import Image
+from docx.shared import Inches, RGBColor, Pt, Emu
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from docx.enum.table import WD_TABLE_ALIGNMENT, WD_CELL_VERTICAL_ALIGNMENT
-import os, datetime, json
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import contextlib
+import tempfile
+import click
+import logging
+import logging.handlers
+import queue
+import sys
+import os, io, datetime, json, time, threading, uuid, math, itertools, mimetypes, bisect, glob, unicodedata, re, collections, copy, struct, zipfile, heapq
+
+try:
+    from xhtml2pdf import pisa  # Conversión HTML -> PDF local, sin red
+except ImportError:  # pragma: no cover - PDF opcional
+    pisa = None
+
+try:
+    import resource  # pico de memoria (ru_maxrss); no existe en Windows
+except ImportError:  # pragma: no cover
+    resource = None
+
+try:
+    import fcntl  # lock de edición entre workers; no existe en Windows
+except ImportError:  # pragma: no cover
+    fcntl = None
 
 # Config
 app = Flask(__name__)
@@ -14,9 +41,744 @@ app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "change-this-in-producti
 app.config["UPLOAD_FOLDER"] = os.path.join(app.root_path, "uploads")
 app.config["GENERATED_FOLDER"] = os.path.join(app.root_path, "generated")
 app.config["MAX_CONTENT_LENGTH"] = 32 * 1024 * 1024  # 32 MB
+app.config["PREVIEW_THUMB_PX"] = 320  # lado máximo de las miniaturas de la vista previa
+app.config["PREVIEW_MAX_AGE"] = int(os.environ.get("PREVIEW_MAX_AGE", 24 * 3600))  # borradores sin confirmar
+# Un PDF sin resultado tras este tiempo se da por fallido (p. ej. el worker murió con la tarea en cola)
+app.config["PDF_PENDING_TIMEOUT"] = float(os.environ.get("PDF_PENDING_TIMEOUT", "300"))
+# Control de admisión para la generación de DOCX
+app.config["GENERATION_MAX_ACTIVE"] = int(os.environ.get("GENERATION_MAX_ACTIVE", "2"))
+app.config["GENERATION_MAX_QUEUE"] = int(os.environ.get("GENERATION_MAX_QUEUE", "8"))
+app.config["GENERATION_PER_CLIENT"] = int(os.environ.get("GENERATION_PER_CLIENT", "2"))
+app.config["GENERATION_WAIT_TIMEOUT"] = float(os.environ.get("GENERATION_WAIT_TIMEOUT", "30"))
+# Proxies de confianza delante de la app (Render agrega uno); 0 = sin proxy
+app.config["TRUSTED_PROXIES"] = int(os.environ.get("TRUSTED_PROXIES", "1"))
+# Log estructurado (una línea JSON) de los submit que superan este tiempo
+app.config["SLOW_REQUEST_SECONDS"] = float(os.environ.get("SLOW_REQUEST_SECONDS", "3"))
+app.config["SLOW_REQUEST_LOG"] = os.environ.get("SLOW_REQUEST_LOG", "")  # vacío = stderr
+
+# Assets con hash generados por build_assets.py
+app.config["ASSET_MANIFEST"] = os.path.join(app.root_path, "static", "dist", "asset-manifest.json")
+app.config["ASSET_MAX_AGE"] = 365 * 24 * 3600  # los nombres con hash nunca cambian de contenido
+# Layouts declarativos del reporte (layouts/<nombre>.json), recompilados al cambiar
+app.config["LAYOUT_FOLDER"] = os.path.join(app.root_path, "layouts")
+app.config["LAYOUT_DEFAULT"] = os.environ.get("LAYOUT_DEFAULT", "mantenimiento")
+app.config["LAYOUT_CHECK_INTERVAL"] = float(os.environ.get("LAYOUT_CHECK_INTERVAL", "2"))
+# Marca (logo y colores) por sitio o cliente
+app.config["BRANDING_FILE"] = os.environ.get("BRANDING_FILE", os.path.join(app.root_path, "branding.json"))
+app.config["BRAND_SITE"] = os.environ.get("BRAND_SITE", "")  # vacío = se usa el host de la petición
+app.config["BRAND_LOGO_DPI"] = int(os.environ.get("BRAND_LOGO_DPI", "300"))
+app.config["BRAND_LOGO_CACHE"] = int(os.environ.get("BRAND_LOGO_CACHE", "32"))
+app.config["BRANDING_CHECK_INTERVAL"] = float(os.environ.get("BRANDING_CHECK_INTERVAL", "5"))
+
+# Límites para imágenes subidas (se validan leyendo solo la cabecera)
+app.config["MAX_IMAGE_PIXELS"] = int(os.environ.get("MAX_IMAGE_PIXELS", 40_000_000))
+app.config["MAX_IMAGE_DECODED_BYTES"] = int(os.environ.get("MAX_IMAGE_DECODED_BYTES", 160 * 1024 * 1024))
+app.config["IMAGE_MAX_SIDE_PX"] = int(os.environ.get("IMAGE_MAX_SIDE_PX", 1600))  # lado máximo guardado
 
 ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
 
+# Formato real (según la cabecera) -> extensión con la que se guarda
+IMAGE_FORMATS = {"PNG": ".png", "JPEG": ".jpg", "GIF": ".gif", "WEBP": ".webp"}
+# python-docx no puede incrustar WEBP: se recodifica al guardar
+REENCODE_IMAGE_FORMATS = {"WEBP"}
+
+# Protección global de Pillow contra bombas de descompresión
+Image.MAX_IMAGE_PIXELS = app.config["MAX_IMAGE_PIXELS"]
+
+# Recursos compartidos que se cargan una sola vez (en el master de gunicorn
+# cuando se usa preload_app, así los workers los comparten copy-on-write)
+_assets = {}
+_warm_state = {"ready": False, "seconds": None}
+_warm_lock = threading.Lock()
+
+# Pool de fondo para la conversión a PDF (no bloquea la respuesta del DOCX)
+_pdf_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("PDF_WORKERS", "1")),
+                                   thread_name_prefix="pdf")
+
+# Métricas simples en memoria expuestas en /metrics
+_metrics = {"pdf": {"generated": 0, "failed": 0, "total_seconds": 0.0, "last_seconds": None},
+            "slow_requests": 0}
+_metrics_lock = threading.Lock()
+
+def peak_rss_kb():
+    """Pico de memoria residente del proceso (KB en Linux), o None si no se puede medir"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+
+class StageTimer:
+    """Tiempos por etapa y forma de una petición, para el log de peticiones lentas"""
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.start = self.last = time.perf_counter()
+        self.rss_kb = peak_rss_kb()
+        self.stages = {}
+        self.info = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = round(now - self.last, 4)
+        self.last = now
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def record(self, status):
+        rss_kb = peak_rss_kb()
+        return dict(
+            self.info,
+            request_id=self.request_id,
+            time=datetime.datetime.now().isoformat(timespec="seconds"),
+            status=status,
+            total_seconds=round(self.elapsed(), 4),
+            stages=self.stages,
+            peak_rss_delta_kb=rss_kb - self.rss_kb if rss_kb is not None else None,
+        )
+
+_slow_log = {"pid": None}
+_slow_log_lock = threading.Lock()
+
+def slow_request_logger():
+    """Logger de peticiones lentas: el request solo encola (QueueHandler) y un hilo escribe.
+
+    El listener se crea por proceso: con preload de gunicorn el hilo del master no
+    sobrevive al fork, así que cada worker arranca el suyo en el primer uso.
+    """
+    logger = logging.getLogger("reportes.lentos")
+    if _slow_log["pid"] != os.getpid():
+        with _slow_log_lock:
+            if _slow_log["pid"] != os.getpid():
+                path = app.config["SLOW_REQUEST_LOG"]
+                target = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+                target.setFormatter(logging.Formatter("%(message)s"))
+                log_queue = queue.SimpleQueue()
+                listener = logging.handlers.QueueListener(log_queue, target)
+                listener.start()
+                atexit.register(listener.stop)
+                logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                _slow_log["pid"] = os.getpid()
+    return logger
+
+class AdmissionController:
+    """Limita las generaciones concurrentes con una cola de espera acotada.
+
+    Cuando se libera un cupo pasa primero el cliente con menos generaciones
+    activas (y, a igualdad, el que llegó antes), así un cliente con muchas
+    peticiones pesadas no acapara el servidor.
+    """
+
+    def __init__(self, max_active, max_queue, per_client, wait_timeout):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.per_client = per_client
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._active = {}     # cliente -> generaciones en curso
+        self._waiting = []    # (seq, cliente) en orden de llegada
+        self._avg_seconds = 2.0
+        self._stats = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_client_limit": 0,
+            "rejected_timeout": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _next_waiter(self):
+        return min(self._waiting, key=lambda w: (self._active.get(w[1], 0), w[0]))
+
+    def acquire(self, client):
+        """Devuelve None si se admite, o el motivo del rechazo"""
+        with self._cond:
+            in_flight = self._active.get(client, 0) + sum(1 for _, c in self._waiting if c == client)
+            if in_flight >= self.per_client:
+                self._stats["rejected_client_limit"] += 1
+                return "client_limit"
+            total_active = sum(self._active.values())
+            if total_active >= self.max_active and len(self._waiting) >= self.max_queue:
+                self._stats["rejected_queue_full"] += 1
+                return "queue_full"
+
+            ticket = (next(self._seq), client)
+            self._waiting.append(ticket)
+            start = time.perf_counter()
+            deadline = start + self.wait_timeout
+            while sum(self._active.values()) >= self.max_active or self._next_waiter() != ticket:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._stats["rejected_timeout"] += 1
+                    self._cond.notify_all()
+                    return "timeout"
+                self._cond.wait(remaining)
+            self._waiting.remove(ticket)
+            self._active[client] = self._active.get(client, 0) + 1
+
+            waited = time.perf_counter() - start
+            self._stats["admitted"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+            return None
+
+    def release(self, client, seconds=None):
+        with self._cond:
+            self._active[client] -= 1
+            if not self._active[client]:
+                del self._active[client]
+            if seconds is not None:
+                # Media móvil del tiempo de generación para estimar Retry-After
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * seconds
+            self._cond.notify_all()
+
+    def retry_after(self):
+        """Segundos sugeridos para reintentar según la cola actual"""
+        with self._cond:
+            pending = len(self._waiting) + sum(self._active.values())
+        return max(1, math.ceil(self._avg_seconds * pending / max(1, self.max_active)))
+
+    def snapshot(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(active=sum(self._active.values()), waiting=len(self._waiting),
+                         avg_generation_seconds=round(self._avg_seconds, 4))
+        stats["wait_seconds_total"] = round(stats["wait_seconds_total"], 4)
+        stats["wait_seconds_max"] = round(stats["wait_seconds_max"], 4)
+        return stats
+
+_admission = AdmissionController(
+    max_active=app.config["GENERATION_MAX_ACTIVE"],
+    max_queue=app.config["GENERATION_MAX_QUEUE"],
+    per_client=app.config["GENERATION_PER_CLIENT"],
+    wait_timeout=app.config["GENERATION_WAIT_TIMEOUT"],
+)
+
+if app.config["TRUSTED_PROXIES"]:
+    # remote_addr pasa a ser la IP que agregó el último proxy de confianza (la de más a la
+    # derecha en X-Forwarded-For); las entradas anteriores las controla el cliente
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+
+def client_key():
+    """Identifica al cliente por la IP que vio el proxy de confianza (no se puede falsificar)"""
+    return request.remote_addr or "desconocido"
+
+class ReportIndex:
+    """Agregado en memoria alimentado por las submissions de los reportes.
+
+    Se persiste como snapshot JSON; al cargar solo se procesan los reportes de
+    generated/ que no estaban en el snapshot, así un reinicio no recorre todo
+    el historial. Los reportes anteriores al guardado de datos JSON se leen del
+    DOCX. Las subclases implementan _ingest, _state y _restore.
+    """
+
+    SNAPSHOT_INTERVAL = 30.0
+
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self._indexed = set()   # reportes ya incorporados
+        self._last_saved = 0.0
+        self._dirty = False
+
+    def __contains__(self, report_id):
+        with self._lock:
+            return report_id in self._indexed
+
+    def add_submission(self, report_id, data, ts=None):
+        """Incorpora una submission (idempotente por report_id); devuelve si era nueva"""
+        with self._lock:
+            if report_id in self._indexed:
+                return False
+            self._indexed.add(report_id)
+            self._ingest(report_id, data, ts or time.time())
+            self._dirty = True
+            return True
+
+    def load(self, reports_folder):
+        """Carga el snapshot y solo indexa los reportes que no estaban en él.
+
+        Con reports_folder=None solo se restaura el snapshot (lo usa backfill-equipos,
+        que recorre los reportes por su cuenta para poder contarlos).
+        """
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as fh:
+                snapshot = json.load(fh)
+        except (OSError, ValueError):
+            snapshot = {}
+        with self._lock:
+            self._restore(snapshot)
+            self._indexed = set(snapshot.get("indexed", []))
+        if reports_folder is None:
+            return
+        for path in glob.glob(os.path.join(reports_folder, "reporte_*.json")):
+            report_id = os.path.splitext(os.path.basename(path))[0]
+            if report_id in self._indexed:
+                continue
+            try:
+                with open(path, encoding="utf-8") as fh:
+                    self.add_submission(report_id, json.load(fh), ts=os.path.getmtime(path))
+            except (OSError, ValueError):
+                continue
+        # Reportes sin JSON guardado: se reconstruyen los datos desde el DOCX (una sola vez,
+        # después quedan en el snapshot)
+        for path in glob.glob(os.path.join(reports_folder, "reporte_*.docx")):
+            report_id = os.path.splitext(os.path.basename(path))[0]
+            if report_id in self._indexed or os.path.getsize(path) == 0:
+                continue  # vacío = nombre reservado por un submit que todavía está generando
+            try:
+                data = extract_report_data(path)
+            except Exception:
+                data = {}  # DOCX ilegible: se marca como indexado para no reintentarlo
+            self.add_submission(report_id, data, ts=os.path.getmtime(path))
+        self.save()
+
+    def save(self, force=True):
+        """Escribe el snapshot (con force=False, como máximo cada SNAPSHOT_INTERVAL s)"""
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._last_saved < self.SNAPSHOT_INTERVAL):
+                return
+            snapshot = json.dumps(dict(self._state(), indexed=sorted(self._indexed)), ensure_ascii=False)
+            self._dirty = False
+            self._last_saved = time.time()
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        tmp_path = self.snapshot_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            fh.write(snapshot)
+        os.replace(tmp_path, self.snapshot_path)
+
+    @staticmethod
+    def normalize(text):
+        """Clave de comparación: minúsculas y sin tildes"""
+        text = unicodedata.normalize("NFKD", (text or "").strip().lower())
+        return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+class AutocompleteIndex(ReportIndex):
+    """Índice de prefijos (arreglo ordenado + bisect) para autocompletar campos del formulario.
+
+    Cada campo guarda sus textos normalizados ordenados; el rango de los que
+    comparten el prefijo sale de dos búsquedas binarias y se ordena completo por
+    frecuencia con decaimiento por antigüedad. Los rangos grandes (prefijos
+    cortos) guardan su top en caché hasta el próximo cambio del campo.
+    """
+
+    FIELDS = ("cliente", "equipo", "condicion")
+    HALF_LIFE_DAYS = 30.0
+    TOP_K = 20          # máximo de sugerencias por consulta
+    CACHE_RANGE = 500   # rangos de más claves que esto guardan su top en caché
+
+    def __init__(self, snapshot_path):
+        super().__init__(snapshot_path)
+        self._keys = {field: [] for field in self.FIELDS}
+        self._entries = {field: {} for field in self.FIELDS}
+        self._top = {field: {} for field in self.FIELDS}   # prefijo -> top (rangos grandes)
+
+    def _add(self, field, text, ts):
+        text = (text or "").strip()
+        key = self.normalize(text)
+        if not key:
+            return
+        entry = self._entries[field].get(key)
+        if entry is None:
+            bisect.insort(self._keys[field], key)
+            entry = self._entries[field][key] = {"text": text, "count": 1, "last": ts}
+        else:
+            entry["count"] += 1
+            if ts >= entry["last"]:
+                # Se muestra la escritura más reciente
+                entry["text"], entry["last"] = text, ts
+        # El puntaje de esta entrada solo sube: basta con reubicarla en los tops en caché
+        for prefix, top in self._top[field].items():
+            if key.startswith(prefix):
+                if not any(e is entry for e in top):
+                    top.append(entry)
+                top.sort(key=self._rank, reverse=True)
+                del top[self.TOP_K:]
+
+    def _remove(self, field, text):
+        key = self.normalize(text)
+        entry = self._entries[field].get(key)
+        if entry is None:
+            return
+        # Si baja una entrada que estaba en un top, otra puede ocupar su lugar: se recalcula
+        cache = self._top[field]
+        for prefix in [p for p, top in cache.items() if any(e is entry for e in top)]:
+            del cache[prefix]
+        entry["count"] -= 1
+        if entry["count"] <= 0:
+            del self._entries[field][key]
+            del self._keys[field][bisect.bisect_left(self._keys[field], key)]
+
+    @staticmethod
+    def _texts(data):
+        """(campo, texto) que aporta una submission al índice"""
+        yield "cliente", data.get("cliente")
+        yield "equipo", data.get("equipo")
+        for cond in data.get("condiciones") or []:
+            yield "condicion", cond.get("text")
+
+    def _ingest(self, report_id, data, ts):
+        for field, text in self._texts(data):
+            self._add(field, text, ts)
+
+    def replace_submission(self, report_id, data, previous):
+        """Actualiza un reporte editado: descuenta los textos de su versión anterior y suma los nuevos"""
+        with self._lock:
+            if report_id in self._indexed and previous:
+                for field, text in self._texts(previous):
+                    self._remove(field, text)
+            self._indexed.discard(report_id)
+        self.add_submission(report_id, data)
+
+    def _state(self):
+        return {"fields": self._entries}
+
+    def _restore(self, snapshot):
+        for field in self.FIELDS:
+            entries = snapshot.get("fields", {}).get(field, {})
+            self._entries[field] = entries
+            self._keys[field] = sorted(entries)
+            self._top[field] = {}
+
+    def _rank(self, entry):
+        """Orden de count * 0.5 ** (edad / vida media) sin depender de "ahora".
+
+        El factor del instante de la consulta es el mismo para todas las entradas,
+        así que comparar log2(count) + last / vida media da el mismo orden y el top
+        de un prefijo sigue siendo válido con el paso del tiempo.
+        """
+        return math.log2(entry["count"]) + entry["last"] / (self.HALF_LIFE_DAYS * 86400)
+
+    def suggest(self, field, prefix, limit=8):
+        key = self.normalize(prefix)
+        with self._lock:
+            keys = self._keys.get(field)
+            if keys is None:
+                raise KeyError(field)
+            top = self._top[field].get(key)
+            if top is None:
+                start = bisect.bisect_left(keys, key)
+                end = bisect.bisect_right(keys, key + "\U0010ffff")
+                entries = self._entries[field]
+                top = heapq.nlargest(self.TOP_K, (entries[k] for k in keys[start:end]), key=self._rank)
+                if end - start > self.CACHE_RANGE:
+                    self._top[field][key] = top
+            return [e["text"] for e in top[:min(limit, self.TOP_K)]]
+
+def parse_reading(text):
+    """Convierte '12,345 km', '1.234,5' o '250 h' a número; None si no hay lectura"""
+    match = re.search(r"\d[\d.,]*", text or "")
+    if not match:
+        return None
+    number = match.group().rstrip(".,")
+    if "," in number and "." in number:
+        # El último separador es el decimal
+        decimal = "," if number.rfind(",") > number.rfind(".") else "."
+        thousands = "." if decimal == "," else ","
+        number = number.replace(thousands, "").replace(decimal, ".")
+    elif "," in number or "." in number:
+        sep = "," if "," in number else "."
+        parts = number.split(sep)
+        if len(parts) > 2 or len(parts[-1]) == 3:
+            number = number.replace(sep, "")  # separador de miles
+        else:
+            number = number.replace(sep, ".")
+    return float(number)
+
+def _report_date(report_id, fecha):
+    """Fecha ISO del reporte; si falta se toma del nombre reporte_..._AAAAMMDD_HHMMSS[_n]"""
+    try:
+        return datetime.date.fromisoformat((fecha or "").strip()).isoformat()
+    except ValueError:
+        match = re.search(r"_(\d{8})_\d{6}(?:_\d+)?$", report_id)
+        if match:
+            return datetime.datetime.strptime(match.group(1), "%Y%m%d").date().isoformat()
+        return ""
+
+class EquipmentHistory(ReportIndex):
+    """Historial por equipo con agregados incrementales de kilometraje, horas y correcciones.
+
+    Cada lectura actualiza en O(log n) la primera/última lectura y el contador,
+    de modo que el resumen (km y horas por intervalo, por día, correcciones más
+    frecuentes) sale en tiempo constante sin recorrer los reportes.
+    """
+
+    def __init__(self, snapshot_path):
+        super().__init__(snapshot_path)
+        self._equipos = {}
+        self._order = {}   # equipo -> claves (fecha, reporte) de la línea de tiempo
+
+    @staticmethod
+    def _new_reading():
+        return {"first": None, "last": None, "count": 0}
+
+    @staticmethod
+    def _add_reading(agg, sort_key, value):
+        if value is None:
+            return
+        point = [sort_key[0], value, sort_key[1]]
+        if agg["first"] is None or sort_key < (agg["first"][0], agg["first"][2]):
+            agg["first"] = point
+        if agg["last"] is None or sort_key >= (agg["last"][0], agg["last"][2]):
+            agg["last"] = point
+        agg["count"] += 1
+
+    def _ingest(self, report_id, data, ts):
+        equipo = (data.get("equipo") or "").strip()
+        key = self.normalize(equipo)
+        if not key:
+            return
+        record = self._equipos.get(key)
+        if record is None:
+            record = self._equipos[key] = {
+                "equipo": equipo,
+                "timeline": [],
+                "km": self._new_reading(),
+                "horas": self._new_reading(),
+                "correcciones": {},
+            }
+            self._order[key] = []
+        entry = {
+            "report": report_id,
+            "fecha": _report_date(report_id, data.get("fecha")),
+            "cliente": (data.get("cliente") or "").strip(),
+            "km": parse_reading(data.get("kilometraje")),
+            "horas": parse_reading(data.get("horas")),
+            "correcciones": [c.get("titulo", "") for c in data.get("correcciones") or []],
+        }
+        sort_key = (entry["fecha"], report_id)
+        position = bisect.bisect(self._order[key], sort_key)
+        self._order[key].insert(position, sort_key)
+        record["timeline"].insert(position, entry)
+        if position == len(record["timeline"]) - 1:
+            record["equipo"] = equipo
+        self._add_reading(record["km"], sort_key, entry["km"])
+        self._add_reading(record["horas"], sort_key, entry["horas"])
+        for titulo in entry["correcciones"]:
+            title_key = self.normalize(titulo)
+            if title_key:
+                counter = record["correcciones"].setdefault(title_key, {"titulo": titulo, "count": 0})
+                counter["count"] += 1
+
+    def replace_submission(self, report_id, data):
+        """Actualiza un reporte editado: quita su entrada anterior y la vuelve a agregar"""
+        with self._lock:
+            # Copia de los items: _remove_entry borra el equipo si queda sin reportes
+            for key, record in list(self._equipos.items()):
+                for position, entry in enumerate(record["timeline"]):
+                    if entry["report"] == report_id:
+                        self._remove_entry(key, position)
+                        break
+            self._indexed.discard(report_id)
+        self.add_submission(report_id, data)
+
+    def _remove_entry(self, key, position):
+        record = self._equipos[key]
+        entry = record["timeline"].pop(position)
+        del self._order[key][position]
+        for titulo in entry["correcciones"]:
+            counter = record["correcciones"].get(self.normalize(titulo))
+            if counter:
+                counter["count"] -= 1
+                if counter["count"] <= 0:
+                    del record["correcciones"][self.normalize(titulo)]
+        # Recalcular solo los agregados de este equipo
+        for field in ("km", "horas"):
+            record[field] = self._new_reading()
+            for other in record["timeline"]:
+                self._add_reading(record[field], (other["fecha"], other["report"]), other[field])
+        if not record["timeline"]:
+            del self._equipos[key], self._order[key]
+
+    def _state(self):
+        return {"equipos": self._equipos}
+
+    def _restore(self, snapshot):
+        self._equipos = snapshot.get("equipos", {})
+        self._order = {key: [(e["fecha"], e["report"]) for e in record["timeline"]]
+                       for key, record in self._equipos.items()}
+
+    @staticmethod
+    def _per_interval(agg):
+        if agg["count"] < 2:
+            return None
+        return round((agg["last"][1] - agg["first"][1]) / (agg["count"] - 1), 2)
+
+    def _summary(self, record):
+        km, horas = record["km"], record["horas"]
+        last = record["timeline"][-1]
+        summary = {
+            "equipo": record["equipo"],
+            "reportes": len(record["timeline"]),
+            "ultimo_reporte": {"report": last["report"], "fecha": last["fecha"], "cliente": last["cliente"]},
+            "ultimo_km": km["last"][1] if km["last"] else None,
+            "ultimas_horas": horas["last"][1] if horas["last"] else None,
+            "km_por_intervalo": self._per_interval(km),
+            "horas_por_intervalo": self._per_interval(horas),
+            "km_por_dia": None,
+        }
+        if km["count"] > 1 and km["first"][0] and km["last"][0]:
+            days = (datetime.date.fromisoformat(km["last"][0]) - datetime.date.fromisoformat(km["first"][0])).days
+            if days > 0:
+                summary["km_por_dia"] = round((km["last"][1] - km["first"][1]) / days, 2)
+        return summary
+
+    def summaries(self):
+        with self._lock:
+            return [self._summary(record) for record in self._equipos.values()]
+
+    def history(self, equipo, top=10):
+        """Resumen, correcciones más frecuentes y línea de tiempo de un equipo"""
+        with self._lock:
+            record = self._equipos.get(self.normalize(equipo))
+            if record is None:
+                return None
+            result = self._summary(record)
+            result["correcciones_frecuentes"] = sorted(
+                record["correcciones"].values(), key=lambda c: c["count"], reverse=True)[:top]
+            result["timeline"] = [dict(e) for e in record["timeline"]]
+            return result
+
+def extract_report_data(docx_path):
+    """Reconstruye los datos básicos de un DOCX generado (para reportes sin JSON guardado)"""
+    document = Document(docx_path)
+    data = {"fecha": "", "cliente": "", "equipo": "", "kilometraje": "", "horas": "",
+            "condiciones": [], "correcciones": []}
+    labels = {"CLIENTE:": "cliente", "EQUIPO:": "equipo", "KILOMETRAJE:": "kilometraje", "HORAS:": "horas"}
+
+    # Todos los párrafos en orden (incluye celdas y tablas anidadas)
+    texts = ["".join(t.text or "" for t in p.iter(qn('w:t'))).strip()
+             for p in document.element.body.iter(qn('w:p'))]
+    texts = [t for t in texts if t]
+    for i, text in enumerate(texts):
+        if text.startswith("FECHA:") and not data["fecha"]:
+            data["fecha"] = text[len("FECHA:"):].strip()
+        for label, field in labels.items():
+            if text == label and i + 1 < len(texts):
+                data[field] = texts[i + 1]
+            elif text.startswith(label) and len(text) > len(label):
+                data[field] = text[len(label):].strip()
+    for field in labels.values():
+        if set(data[field]) == {"X"}:
+            data[field] = ""  # marcador de campo vacío
+
+    # Checklist (lista o tabla compacta): "☑ texto" / "☐ texto"
+    for text in texts:
+        if text[0] in "☑☐" and text[1:].strip() not in ("", "-"):
+            data["condiciones"].append({"text": text[1:].strip(), "checked": text[0] == "☑"})
+
+    in_corrections = False
+    for table in document.tables:
+        title = table.rows[0].cells[0].text.strip() if table.rows else ""
+        if title.endswith("CORRECCIONES"):
+            in_corrections = True
+        elif in_corrections and len(table.rows) == 2 and title:
+            data["correcciones"].append({"titulo": title})
+    return data
+
+_autocomplete = AutocompleteIndex(os.path.join(app.config["GENERATED_FOLDER"], "autocomplete.json"))
+atexit.register(_autocomplete.save)
+
+_equipment = EquipmentHistory(os.path.join(app.config["GENERATED_FOLDER"], "equipos.json"))
+atexit.register(_equipment.save)
+
+_asset_manifest = {}
+_hashed_assets = set()   # nombres con hash (valores del manifiesto): los únicos inmutables
+
+def load_asset_manifest():
+    """Carga el mapeo nombre lógico -> nombre con hash (vacío si no se ejecutó el build)"""
+    try:
+        with open(app.config["ASSET_MANIFEST"], encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        manifest = {}
+    _asset_manifest.clear()
+    _asset_manifest.update(manifest)
+    _hashed_assets.clear()
+    _hashed_assets.update(manifest.values())
+
+load_asset_manifest()
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """url_for('static', filename='css/styles.css') -> static/dist/css/styles.<hash>.css"""
+    if endpoint == "static" and not app.debug:
+        hashed = _asset_manifest.get(values.get("filename"))
+        if hashed:
+            values["filename"] = hashed
+
+def static_files(filename):
+    """Static de Flask + variantes .br/.gz en dist/ y caché inmutable solo para los assets con hash"""
+    if not filename.startswith("dist/"):
+        return app.send_static_file(filename)
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        # quality() respeta q=0 ("br;q=0" rechaza br), a diferencia de "in"
+        if request.accept_encodings.quality(encoding) > 0 and \
+                os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+            response = send_from_directory(app.static_folder, filename + suffix,
+                                           mimetype=mimetypes.guess_type(filename)[0])
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = app.send_static_file(filename)
+    response.vary.add("Accept-Encoding")
+    if filename in _hashed_assets:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config["ASSET_MAX_AGE"]
+        response.cache_control.immutable = True
+    else:
+        # Nombre fijo cuyo contenido cambia en cada build (asset-manifest.json): revalidar siempre
+        response.cache_control.no_cache = True
+    return response
+
+app.view_functions["static"] = static_files
+
+def warmup():
+    """Precarga plantilla DOCX por defecto, logo, plantillas Jinja y layouts (idempotente)"""
+    with _warm_lock:
+        if _warm_state["ready"]:
+            return
+        start = time.perf_counter()
+
+        # Plantilla por defecto de python-docx serializada una vez
+        buf = io.BytesIO()
+        Document().save(buf)
+        _assets["docx_template"] = buf.getvalue()
+
+        # Compilar plantillas Jinja (quedan en la caché del entorno)
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+
+        # Índices de autocompletado e historial de equipos (snapshot + reportes nuevos)
+        load_indexes()
+
+        # Compilar los layouts declarativos a planes de construcción
+        _layouts.load()
+        # Logos de todas las marcas ya reducidos al tamaño del encabezado
+        for plan in _layouts.plans():
+            _branding.load(plan.style, plan.logo_heights)
+
+        _warm_state["seconds"] = round(time.perf_counter() - start, 4)
+        _warm_state["ready"] = True
+
+def load_indexes():
+    """Carga los índices desde su snapshot más los reportes guardados después.
+
+    Con preload, un worker que gunicorn vuelve a crear hereda los índices del master
+    tal como estaban al arrancar: los recarga para no perder (ni sobrescribir en
+    equipos.json) los reportes generados desde entonces.
+    """
+    _autocomplete.load(app.config["GENERATED_FOLDER"])
+    _equipment.load(app.config["GENERATED_FOLDER"])
+
+def new_document():
+    """Crea un Document a partir de la plantilla precargada"""
+    if not _warm_state["ready"]:
+        warmup()
+    return Document(io.BytesIO(_assets["docx_template"]))
+
 def ensure_dirs():
     os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
     os.makedirs(app.config["GENERATED_FOLDER"], exist_ok=True)
@@ -25,14 +787,9 @@ def ensure_dirs():
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
 
-def set_font_cambria_10(run):
-    """Helper para aplicar fuente Cambria 10pt a un run"""
-    run.font.name = 'Cambria'
-    run.font.size = Pt(10)
-
-def set_font_cambria_size(run, size_pt):
-    """Helper para aplicar fuente Cambria con tamaño específico"""
-    run.font.name = 'Cambria'
+def set_font(run, name, size_pt):
+    """Helper para aplicar fuente y tamaño a un run"""
+    run.font.name = name
     run.font.size = Pt(size_pt)
 
 def add_cell_borders(cell):
@@ -96,19 +853,88 @@ def merge_cells_horizontal(table, row_idx, start_col, end_col):
     
     return cell
 
-@app.route("/")
-def index():
-    hoy = datetime.date.today().isoformat()
-    return render_template("form.html", today=hoy)
+class ImageRejected(ValueError):
+    """La imagen subida no pasa la validación de formato o tamaño"""
 
-@app.route("/submit", methods=["POST"])
-def submit():
-    ensure_dirs()
+def inspect_image(stream):
+    """Lee solo la cabecera de la imagen y valida formato real, píxeles y memoria decodificada"""
+    pos = stream.tell()
+    try:
+        with Image.open(stream) as img:
+            fmt, size, mode = img.format, img.size, img.mode
+    except Image.DecompressionBombError:
+        raise ImageRejected("la imagen supera el límite de píxeles")
+    except Exception:
+        raise ImageRejected("el archivo no es una imagen válida")
+    finally:
+        stream.seek(pos)
+
+    if fmt not in IMAGE_FORMATS:
+        raise ImageRejected(f"formato no soportado ({fmt})")
+    width, height = size
+    if width * height > app.config["MAX_IMAGE_PIXELS"]:
+        raise ImageRejected(f"la imagen es demasiado grande ({width}x{height} px)")
+    decoded_bytes = width * height * Image.getmodebands(mode)
+    if decoded_bytes > app.config["MAX_IMAGE_DECODED_BYTES"]:
+        raise ImageRejected(f"la imagen ocupa demasiada memoria al decodificarse ({decoded_bytes // 2**20} MB)")
+    return fmt, size, mode
+
+def save_reduced_image(stream, fmt, dest_stem):
+    """Decodifica a resolución reducida y guarda; devuelve el nombre del archivo"""
+    max_side = app.config["IMAGE_MAX_SIDE_PX"]
+    with Image.open(stream) as img:
+        if fmt == "JPEG":
+            # JPEG se decodifica directamente a 1/2, 1/4 u 1/8 de resolución
+            img.draft("RGB", (max_side, max_side))
+        img.thumbnail((max_side, max_side))
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            filename = dest_stem + ".png"
+            img.save(os.path.join(app.config["UPLOAD_FOLDER"], filename), "PNG", optimize=True)
+        else:
+            filename = dest_stem + ".jpg"
+            img.convert("RGB").save(os.path.join(app.config["UPLOAD_FOLDER"], filename), "JPEG", quality=85)
+    return filename
+
+def save_upload(file):
+    """Guarda una imagen subida con nombre único; devuelve la ruta relativa o None.
+
+    Lanza ImageRejected si la cabecera no pasa los límites configurados.
+    """
+    if not (file and file.filename and allowed_file(file.filename)):
+        return None
+    fmt, (width, height), _ = inspect_image(file.stream)
+    filename = secure_filename(file.filename)
+    ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    name, ext = os.path.splitext(filename)
+    if fmt in REENCODE_IMAGE_FORMATS or max(width, height) > app.config["IMAGE_MAX_SIDE_PX"]:
+        filename = save_reduced_image(file.stream, fmt, f"{name}_{ts}")
+    else:
+        # Extensión según el formato real, no según el nombre que envió el cliente
+        filename = f"{name}_{ts}{IMAGE_FORMATS[fmt]}"
+        file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+    return f"/uploads/{filename}"
+
+def collect_submission():
+    """Lee el formulario, guarda las imágenes subidas y devuelve los datos estructurados.
+
+    Devuelve (datos, imágenes descartadas): cada descartada es {"filename", "reason"}
+    para mostrarla en la página de resultado o en la respuesta JSON.
+    """
     fecha = request.form.get("fecha", "").strip()
     cliente = request.form.get("cliente", "").strip()
     equipo = request.form.get("equipo", "").strip()
     kilometraje = request.form.get("kilometraje", "").strip()
     horas = request.form.get("horas", "").strip()
+    # Checklist: "compacto" fuerza la tabla en columnas; vacío = automático según la cantidad
+    checklist = request.form.get("checklist", "").strip()
+    # Marca según cliente o sitio (se guarda para que las ediciones mantengan la misma)
+    marca = _branding.resolve(cliente, request.host)
+    # Tipo de reporte: layouts/<layout>.json (se guarda para editarlo después con el mismo layout)
+    layout = request.form.get("layout", "").strip() or app.config["LAYOUT_DEFAULT"]
+    try:
+        _layouts.get(layout)
+    except KeyError:
+        layout = app.config["LAYOUT_DEFAULT"]
 
     conditions_json = request.form.get("conditions_json", "[]")
     try:
@@ -121,21 +947,17 @@ def submit():
     correcciones_imagenes = request.files.getlist("corrections_img[]")
 
     saved_correcciones = []
+    rejected_images = []
     for idx, desc in enumerate(correcciones_descripciones):
         desc = (desc or "").strip()
         titulo = correcciones_titulos[idx] if idx < len(correcciones_titulos) else ""
         titulo = (titulo or "").strip()
         file = correcciones_imagenes[idx] if idx < len(correcciones_imagenes) else None
-        img_rel_path = None
-        
-        if file and file.filename and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
-            name, ext = os.path.splitext(filename)
-            filename = f"{name}_{ts}{ext}"
-            file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-            file.save(file_path)
-            img_rel_path = f"/uploads/{filename}"
+        try:
+            img_rel_path = save_upload(file)
+        except ImageRejected as e:
+            rejected_images.append({"filename": file.filename, "reason": str(e)})
+            img_rel_path = None
         
         if desc or img_rel_path or titulo:
             saved_correcciones.append({
@@ -144,350 +966,1479 @@ def submit():
                 "imagen": img_rel_path
             })
 
-    ts_base = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    base_name = f"reporte_mantenimiento_{ts_base}"
-    docx_path = os.path.join(app.config["GENERATED_FOLDER"], base_name + ".docx")
+    return {
+        "fecha": fecha,
+        "cliente": cliente,
+        "equipo": equipo,
+        "kilometraje": kilometraje,
+        "horas": horas,
+        "condiciones": condiciones,
+        "correcciones": saved_correcciones,
+        "layout": layout,
+        "marca": marca,
+        "checklist": checklist if checklist in ("compacto", "lista") else None,
+    }, rejected_images
 
-    # --- Generar DOCX con estilo corporativo CORREGIDO ---
-    try:
-        document = Document()
+def set_cell_shading(cell, fill):
+    """Helper para aplicar color de fondo (w:shd) a una celda"""
+    tcPr = cell._tc.get_or_add_tcPr()
+    shd = OxmlElement('w:shd')
+    shd.set(qn('w:val'), 'clear')
+    shd.set(qn('w:color'), 'auto')
+    shd.set(qn('w:fill'), fill)
+    tcPr.append(shd)
 
-        # CREAR ENCABEZADO (método alternativo más confiable)
-        # Crear tabla de encabezado en el cuerpo del documento
-        header_table = document.add_table(rows=1, cols=3)
-        header_table.alignment = WD_TABLE_ALIGNMENT.CENTER
-        
-        # Configurar para repetir como encabezado en todas las páginas
-        header_table.rows[0]._tr.get_or_add_trPr().append(
-            OxmlElement('w:tblHeader')
-        )
-        
-        # Configurar anchos de columnas - IGUALAR CON TABLA DE DATOS
-        header_table.columns[0].width = Inches(1.5)  # Logo - IGUAL QUE DATOS
-        header_table.columns[1].width = Inches(2.0)  # Título - IGUAL QUE DATOS  
-        header_table.columns[2].width = Inches(1.0)  # Versión/Fecha - AJUSTADO
-        
-        cells = header_table.rows[0].cells
-        
-        # Configurar altura de fila más compacta
-        header_table.rows[0].height = Inches(0.8)
-        
-        # Configurar bordes y alineación vertical para todas las celdas
-        for cell in cells:
+def tag_fragment(table, tag):
+    """Marca una tabla (w:tblCaption) para poder ubicarla al editar el reporte"""
+    caption = OxmlElement('w:tblCaption')
+    caption.set(qn('w:val'), f"navitrans:{tag}")
+    table._tbl.tblPr.append(caption)
+    return table
+
+def fragment_tag(element):
+    """Devuelve la marca de un elemento del cuerpo, o None si no tiene"""
+    if element.tag != qn('w:tbl') or element.tblPr is None:
+        return None
+    caption = element.tblPr.find(qn('w:tblCaption'))
+    if caption is None:
+        return None
+    value = caption.get(qn('w:val')) or ""
+    return value[len("navitrans:"):] if value.startswith("navitrans:") else None
+
+def add_section_title(document, text, style, tag=None):
+    """Crea una franja del color de acento (tabla de una celda) como título de sección"""
+    t = document.add_table(rows=1, cols=1)
+    t.alignment = WD_TABLE_ALIGNMENT.CENTER  # CENTRAR TABLA
+    c = t.rows[0].cells[0]
+    # Add run
+    run = c.paragraphs[0].add_run(text)
+    run.bold = True
+    set_font(run, style["font"], style["title_size"])
+    # Apply accent fill to the cell (w:shd)
+    set_cell_shading(c, style["accent"])
+    run.font.color.rgb = style["accent_text"]
+    if tag:
+        tag_fragment(t, tag)
+    return t
+
+def add_report_header(document, data, style, opts):
+    """Tabla de encabezado: logo, título en franja de acento y versión/fecha"""
+    # CREAR ENCABEZADO (método alternativo más confiable)
+    # Crear tabla de encabezado en el cuerpo del documento
+    header_table = document.add_table(rows=1, cols=3)
+    header_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+    
+    # Configurar para repetir como encabezado en todas las páginas
+    header_table.rows[0]._tr.get_or_add_trPr().append(
+        OxmlElement('w:tblHeader')
+    )
+    
+    # Anchos de columnas: logo, título, versión/fecha (igualar con tabla de datos)
+    for column, width in zip(header_table.columns, opts["widths"]):
+        column.width = width
+    
+    cells = header_table.rows[0].cells
+    
+    # Configurar altura de fila más compacta
+    header_table.rows[0].height = opts["height"]
+    
+    # Configurar bordes y alineación vertical para todas las celdas
+    for cell in cells:
+        add_cell_borders(cell)
+        set_cell_vertical_alignment(cell, 'center')
+
+    # Celda izquierda: Logo NAVITRANS
+    left_para = cells[0].paragraphs[0]
+    left_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    
+    # Logo de la marca (ya reducido y en memoria); si no existe usar texto
+    logo_bytes = _branding.logo(style.get("logo"), opts["logo_height"])
+    if logo_bytes:
+        try:
+            left_para.add_run().add_picture(io.BytesIO(logo_bytes), height=opts["logo_height"])
+        except:
+            # Fallback a texto si hay error con la imagen
+            fallback_run = left_para.add_run(opts["logo_fallback"])
+            set_font(fallback_run, style["font"], 9)
+            fallback_run.bold = True
+    else:
+        # Texto como fallback si no hay logo
+        fallback_run = left_para.add_run(opts["logo_fallback"])
+        set_font(fallback_run, style["font"], 9)
+        fallback_run.bold = True
+
+    # Celda central: Título con fondo de acento
+    mid_para = cells[1].paragraphs[0]
+    mid_run = mid_para.add_run(opts["title"])
+    mid_run.bold = True
+    set_font(mid_run, style["font"], opts["title_size"])
+    mid_run.font.color.rgb = style["accent_text"]
+    mid_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    
+    # Aplicar fondo de acento a la celda central
+    set_cell_shading(cells[1], style["accent"])
+
+    # Celda derecha: Versión y fecha centradas
+    right_cell = cells[2]
+    # Eliminar párrafo original
+    right_cell._element.clear_content()
+    
+    # Crear tabla anidada para VERSION y FECHA
+    right_table = right_cell.add_table(rows=2, cols=1)
+    right_table.autofit = True
+    
+    # Configurar bordes de la tabla anidada y centrado
+    for row in right_table.rows:
+        row.height = Inches(0.3)
+        for cell in row.cells:
             add_cell_borders(cell)
             set_cell_vertical_alignment(cell, 'center')
+    
+    # Fila 1: VERSIÓN centrada
+    version_cell = right_table.rows[0].cells[0]
+    version_para = version_cell.paragraphs[0]
+    version_run = version_para.add_run(opts["version"])
+    set_font(version_run, style["font"], opts["meta_size"])
+    version_run.bold = True
+    version_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    
+    # Fila 2: FECHA centrada
+    fecha_cell = right_table.rows[1].cells[0]
+    fecha_para = fecha_cell.paragraphs[0]
+    fecha_run = fecha_para.add_run(f"{opts['date_label']}{data.get(opts['field']) or opts['placeholder']}")
+    set_font(fecha_run, style["font"], opts["meta_size"])
+    fecha_run.bold = True
+    fecha_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    return tag_fragment(header_table, opts["tag"])
 
-        # Celda izquierda: Logo NAVITRANS
-        left_para = cells[0].paragraphs[0]
-        left_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+def add_datos_generales(document, data, style, opts):
+    """Tabla de datos generales con filas alternadas en gris"""
+    # Crear tabla para datos generales con filas alternadas en gris - TABLA CENTRADA
+    datos_table = document.add_table(rows=len(opts["rows"]), cols=2)
+    datos_table.autofit = False  
+    
+    # CENTRAR TABLA EN LA PÁGINA
+    datos_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+    
+    # Anchos de columnas: etiquetas y valores
+    for column, width in zip(datos_table.columns, opts["widths"]):
+        column.width = width
+    
+    # Colores alternados (gris claro y gris más oscuro)
+    colores = opts["fills"]
+    
+    for i, (etiqueta, campo) in enumerate(opts["rows"]):
+        row = datos_table.rows[i]
+        color_fila = colores[i % len(colores)]  # Alterna entre los colores
+        valor = data.get(campo) or opts["placeholder"]
         
-        # Intentar cargar logo, si no existe usar texto
-        logo_path = os.path.join(app.root_path, "static", "img", "logo.png")
-        if os.path.exists(logo_path):
-            try:
-                left_para.add_run().add_picture(logo_path, height=Inches(0.6))
-            except:
-                # Fallback a texto si hay error con la imagen
-                fallback_run = left_para.add_run("NAVITRANS\nMantenimiento")
-                set_font_cambria_size(fallback_run, 9)
-                fallback_run.bold = True
-        else:
-            # Texto como fallback si no hay logo
-            fallback_run = left_para.add_run("NAVITRANS\nMantenimiento")
-            set_font_cambria_size(fallback_run, 9)
-            fallback_run.bold = True
-
-        # Celda central: Título con fondo rojo
-        mid_para = cells[1].paragraphs[0]
-        mid_run = mid_para.add_run("REPORTE TÉCNICO\nSERVICIO TALLER")
-        mid_run.bold = True
-        set_font_cambria_size(mid_run, 11)
-        mid_run.font.color.rgb = RGBColor(255, 255, 255)  # Texto blanco
-        mid_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        # Celda de etiqueta (columna izquierda)
+        celda_etiqueta = row.cells[0]
+        set_cell_vertical_alignment(celda_etiqueta, 'center')
         
-        # Aplicar fondo rojo a la celda central
-        tc_mid = cells[1]._tc
-        tcPr_mid = tc_mid.get_or_add_tcPr()
-        shd_mid = OxmlElement('w:shd')
-        shd_mid.set(qn('w:val'), 'clear')
-        shd_mid.set(qn('w:color'), 'auto')
-        shd_mid.set(qn('w:fill'), 'E30613')  # Rojo
-        tcPr_mid.append(shd_mid)
-
-        # Celda derecha: Versión y fecha centradas
-        right_cell = cells[2]
-        # Eliminar párrafo original
-        right_cell._element.clear_content()
+        # Aplicar color de fondo
+        set_cell_shading(celda_etiqueta, color_fila)
         
-        # Crear tabla anidada para VERSION y FECHA
-        right_table = right_cell.add_table(rows=2, cols=1)
-        right_table.autofit = True
+        # Texto de etiqueta - CENTRADO TAMBIÉN
+        para_etiqueta = celda_etiqueta.paragraphs[0]
+        run_etiqueta = para_etiqueta.add_run(etiqueta)
+        run_etiqueta.bold = True
+        set_font(run_etiqueta, style["font"], opts["size"])
+        para_etiqueta.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER  # CENTRADO
         
-        # Configurar bordes de la tabla anidada y centrado
-        for row in right_table.rows:
-            row.height = Inches(0.3)
-            for cell in row.cells:
-                add_cell_borders(cell)
-                set_cell_vertical_alignment(cell, 'center')
+        # Celda de valor (columna derecha)
+        celda_valor = row.cells[1]
+        set_cell_vertical_alignment(celda_valor, 'center')
         
-        # Fila 1: VERSIÓN centrada
-        version_cell = right_table.rows[0].cells[0]
-        version_para = version_cell.paragraphs[0]
-        version_run = version_para.add_run("VERSIÓN: 01")
-        set_font_cambria_size(version_run, 8)
-        version_run.bold = True
-        version_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        # Aplicar mismo color de fondo
+        set_cell_shading(celda_valor, color_fila)
         
-        # Fila 2: FECHA centrada
-        fecha_cell = right_table.rows[1].cells[0]
-        fecha_para = fecha_cell.paragraphs[0]
-        fecha_run = fecha_para.add_run(f"FECHA: {fecha or 'XXXXXXXX'}")
-        set_font_cambria_size(fecha_run, 8)
-        fecha_run.bold = True
-        fecha_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-
-        # Espacio después del header en el cuerpo del documento
-        document.add_paragraph()
+        # Texto de valor - CENTRADO tanto horizontal como vertical
+        para_valor = celda_valor.paragraphs[0]
+        run_valor = para_valor.add_run(valor)
+        set_font(run_valor, style["font"], opts["size"])
+        para_valor.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    return tag_fragment(datos_table, opts["tag"])
 
-        # Helper: create a red strip (table cell background) for section title
-        def add_section_title(text):
-            t = document.add_table(rows=1, cols=1)
-            t.alignment = WD_TABLE_ALIGNMENT.CENTER  # CENTRAR TABLA
-            c = t.rows[0].cells[0]
-            # Add run
-            run = c.paragraphs[0].add_run(text)
-            run.bold = True
-            set_font_cambria_size(run, 12)  # 12pt para títulos de sección
-            # Apply red fill to the cell (w:shd)
-            tc = c._tc
-            tcPr = tc.get_or_add_tcPr()
-            shd = OxmlElement('w:shd')
-            shd.set(qn('w:val'), 'clear')
-            shd.set(qn('w:color'), 'auto')
-            shd.set(qn('w:fill'), 'E30613')  # red without '#'
-            tcPr.append(shd)
-            # Set font color to white
-            run.font.color.rgb = RGBColor(255, 255, 255)
-            return t
-
-        add_section_title("1. DATOS GENERALES")
-        
-        # Agregar espacio entre el título y la tabla
-        document.add_paragraph()
-        
-        # Crear tabla para datos generales con filas alternadas en gris - TABLA CENTRADA
-        datos_table = document.add_table(rows=4, cols=2)
-        datos_table.autofit = False  
-        
-        # CENTRAR TABLA EN LA PÁGINA
-        datos_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+def add_condition(document, c, style):
+    """Párrafo de checklist para una condición"""
+    marcado = "☑" if c.get("checked") else "☐"
+    cond_para = document.add_paragraph()
+    cond_run = cond_para.add_run(f"{marcado} {c.get('text','-')}")
+    set_font(cond_run, style["font"], style["text_size"])
+    return cond_para
+
+def add_checklist_table(document, condiciones, style, opts):
+    """Checklist compacto: una sola tabla en varias columnas, agrupada por categoría.
+
+    Se arma una celda de ítem y una fila de título con la API de python-docx y el resto de
+    la tabla se construye clonando esas plantillas, sin volver a aplicar formato por run.
+    """
+    columns = opts["columns"]
+    grupos = {}
+    for c in condiciones:
+        grupos.setdefault(str(c.get("category") or "").strip() or "General", []).append(c)
+    # Sin categorías explícitas no hacen falta filas de título
+    titled = list(grupos) != ["General"]
+
+    table = document.add_table(rows=2, cols=columns)
+    table.alignment = WD_TABLE_ALIGNMENT.CENTER
+    table.autofit = False
+    for column in table.columns:
+        column.width = Emu(opts["width"] // columns)
+
+    # Plantillas: celda vacía, celda de ítem y fila de título (categoría)
+    item_cell = table.rows[1].cells[0]
+    empty_tc = copy.deepcopy(item_cell._tc)
+    item_run = item_cell.paragraphs[0].add_run("-")
+    set_font(item_run, style["font"], opts["size"])
+    item_tc = item_cell._tc
+    title_cell = merge_cells_horizontal(table, 0, 0, columns - 1)
+    set_cell_shading(title_cell, style["muted"])
+    title_run = title_cell.paragraphs[0].add_run("-")
+    title_run.bold = True
+    set_font(title_run, style["font"], opts["size"])
+    tbl = table._tbl
+    title_tr = tbl.tr_lst[0]
+    for tr in tbl.tr_lst:
+        tbl.remove(tr)
+
+    def clone(template, text):
+        element = copy.deepcopy(template)
+        t = element.find(".//" + qn("w:t"))
+        t.text = text
+        if text != text.strip():
+            t.set(qn("xml:space"), "preserve")
+        return element
+
+    for categoria, items in grupos.items():
+        if titled:
+            tbl.append(clone(title_tr, categoria))
+        for start in range(0, len(items), columns):
+            tr = OxmlElement("w:tr")
+            for c in items[start:start + columns]:
+                marcado = "☑" if c.get("checked") else "☐"
+                tr.append(clone(item_tc, f"{marcado} {c.get('text','-')}"))
+            for _ in range(columns - len(items[start:start + columns])):
+                tr.append(copy.deepcopy(empty_tc))
+            tbl.append(tr)
+    return tag_fragment(table, "checklist")
+
+def add_correction(document, corr, i, style, opts):
+    """Tabla 2x2 de una corrección: título, imagen y descripción"""
+    # Crear tabla de 2 filas x 2 columnas para cada corrección
+    corr_table = document.add_table(rows=2, cols=2)
+    corr_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+    
+    # Anchos: columna de imagen y columna de descripción
+    for column, width in zip(corr_table.columns, opts["widths"]):
+        column.width = width
+    
+    # FILA 1: Título (combinar columnas)
+    title_cell = merge_cells_horizontal(corr_table, 0, 0, 1)
+    
+    # Configurar título con fondo de acento
+    title_para = title_cell.paragraphs[0]
+    title_run = title_para.add_run(corr.get("titulo", f"Corrección {i}"))
+    title_run.bold = True
+    set_font(title_run, style["font"], opts["title_size"])
+    title_run.font.color.rgb = style["accent_text"]
+    title_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    set_cell_vertical_alignment(title_cell, 'center')
+    
+    # Aplicar fondo de acento al título
+    set_cell_shading(title_cell, style["accent"])
+    
+    # FILA 2: Imagen en columna 1
+    img_cell = corr_table.rows[1].cells[0]
+    set_cell_vertical_alignment(img_cell, 'center')
+    
+    if corr.get("imagen"):
+        img_abs = os.path.join(app.root_path, corr["imagen"].lstrip("/"))
+        try:
+            img_para = img_cell.paragraphs[0]
+            img_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+            img_para.add_run().add_picture(img_abs, width=opts["image_width"])
+        except Exception:
+            error_para = img_cell.paragraphs[0]
+            error_run = error_para.add_run("(No se pudo insertar la imagen)")
+            set_font(error_run, style["font"], style["text_size"])
+            error_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    else:
+        # Placeholder si no hay imagen
+        no_img_para = img_cell.paragraphs[0]
+        no_img_run = no_img_para.add_run("(Sin imagen)")
+        set_font(no_img_run, style["font"], style["text_size"])
+        no_img_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    
+    # FILA 2: Descripción en columna 2
+    desc_cell = corr_table.rows[1].cells[1]
+    set_cell_vertical_alignment(desc_cell, 'center')
+    
+    # Aplicar fondo gris claro a la celda de descripción
+    set_cell_shading(desc_cell, style["muted"])
+    
+    if corr.get("descripcion"):
+        desc_para = desc_cell.paragraphs[0]
+        desc_run = desc_para.add_run(corr.get("descripcion"))
+        set_font(desc_run, style["font"], style["text_size"])
+        desc_para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY  # Justificar texto
+    else:
+        # Placeholder si no hay descripción
+        no_desc_para = desc_cell.paragraphs[0]
+        no_desc_run = no_desc_para.add_run("(Sin descripción)")
+        set_font(no_desc_run, style["font"], style["text_size"])
+        no_desc_para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
+    
+    # Aplicar solo bordes exteriores gruesos
+    add_thick_outer_borders_only(corr_table)
+    return tag_fragment(corr_table, "correccion")
+
+def add_corrections(document, correcciones, style, opts):
+    """Tablas de correcciones separadas por párrafos vacíos"""
+    for i, corr in enumerate(correcciones, start=1):
+        # Espacio antes de cada tabla de corrección (excepto la primera)
+        if i > 1:
+            document.add_paragraph()
         
-        # REDUCIR significativamente los anchos de columnas
-        datos_table.columns[0].width = Inches(1.5)  # Columna etiquetas - REDUCIDO de 2.0 a 1.5
-        datos_table.columns[1].width = Inches(2.0)   # Columna valores - REDUCIDO de 2.5 a 2.0
+        add_correction(document, corr, i, style, opts)
         
-        # Datos para la tabla
-        datos = [
-            ("CLIENTE:", cliente or 'XXXXXXXXXX'),
-            ("EQUIPO:", equipo or 'XXXXXXXXXX'),
-            ("KILOMETRAJE:", kilometraje or 'XXXXXXXXXX'),
-            ("HORAS:", horas or 'XXXXXXXXXX')
-        ]
+        # Espacio después de cada tabla de corrección
+        document.add_paragraph()
+
+def add_page_footer(document, style, opts):
+    """Pie de página con campo PAGE dinámico (centrado)"""
+    section = document.sections[0]
+    footer = section.footer
+    footer_para = footer.paragraphs[0] if footer.paragraphs else footer.add_paragraph()
+    footer_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    
+    # Crear footer con campo PAGE dinámico
+    try:
+        # Texto "Página "
+        run1 = footer_para.add_run(opts["text"])
+        set_font(run1, style["font"], opts["size"])
         
-        # Colores alternados (gris claro y gris más oscuro)
-        colores = ['E6E6E6', 'D0D0D0']  # Gris claro, Gris más oscuro
+        # Campo PAGE dinámico
+        run2 = footer_para.add_run()
+        fldChar1 = OxmlElement('w:fldChar')
+        fldChar1.set(qn('w:fldCharType'), 'begin')
         
-        for i, (etiqueta, valor) in enumerate(datos):
-            row = datos_table.rows[i]
-            color_fila = colores[i % 2]  # Alterna entre los dos colores
-            
-            # Celda de etiqueta (columna izquierda)
-            celda_etiqueta = row.cells[0]
-            set_cell_vertical_alignment(celda_etiqueta, 'center')
-            
-            # Aplicar color de fondo
-            tc_etiqueta = celda_etiqueta._tc
-            tcPr_etiqueta = tc_etiqueta.get_or_add_tcPr()
-            shd_etiqueta = OxmlElement('w:shd')
-            shd_etiqueta.set(qn('w:val'), 'clear')
-            shd_etiqueta.set(qn('w:color'), 'auto')
-            shd_etiqueta.set(qn('w:fill'), color_fila)
-            tcPr_etiqueta.append(shd_etiqueta)
-            
-            # Texto de etiqueta - CENTRADO TAMBIÉN
-            para_etiqueta = celda_etiqueta.paragraphs[0]
-            run_etiqueta = para_etiqueta.add_run(etiqueta)
-            run_etiqueta.bold = True
-            set_font_cambria_size(run_etiqueta, 11)
-            para_etiqueta.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER  # CENTRADO
-            
-            # Celda de valor (columna derecha)
-            celda_valor = row.cells[1]
-            set_cell_vertical_alignment(celda_valor, 'center')
-            
-            # Aplicar mismo color de fondo
-            tc_valor = celda_valor._tc
-            tcPr_valor = tc_valor.get_or_add_tcPr()
-            shd_valor = OxmlElement('w:shd')
-            shd_valor.set(qn('w:val'), 'clear')
-            shd_valor.set(qn('w:color'), 'auto')
-            shd_valor.set(qn('w:fill'), color_fila)
-            tcPr_valor.append(shd_valor)
-            
-            # Texto de valor - CENTRADO tanto horizontal como vertical
-            para_valor = celda_valor.paragraphs[0]
-            run_valor = para_valor.add_run(valor)
-            set_font_cambria_size(run_valor, 11)
-            para_valor.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-
-        # Agregar espacio moderado entre secciones
-        document.add_paragraph()
+        instrText = OxmlElement('w:instrText')
+        instrText.text = 'PAGE'
         
-        add_section_title("2. CONDICIONES")
-        for c in condiciones:
-            marcado = "☑" if c.get("checked") else "☐"
-            cond_para = document.add_paragraph()
-            cond_run = cond_para.add_run(f"{marcado} {c.get('text','-')}")
-            set_font_cambria_10(cond_run)
-
-        add_section_title("3. CORRECCIONES")
+        fldChar2 = OxmlElement('w:fldChar')
+        fldChar2.set(qn('w:fldCharType'), 'end')
         
-        # Agregar espacio entre el título y las correcciones
-        document.add_paragraph()
+        run2._r.append(fldChar1)
+        run2._r.append(instrText)
+        run2._r.append(fldChar2)
+        set_font(run2, style["font"], opts["size"])
         
-        # NUEVA IMPLEMENTACIÓN DE CORRECCIONES CON TABLAS
-        for i, corr in enumerate(saved_correcciones, start=1):
-            # Espacio antes de cada tabla de corrección (excepto la primera)
-            if i > 1:
-                document.add_paragraph()
-            
-            # Crear tabla de 2 filas x 2 columnas para cada corrección
-            corr_table = document.add_table(rows=2, cols=2)
-            corr_table.alignment = WD_TABLE_ALIGNMENT.CENTER
-            
-            # Tamaño intermedio para las tablas de corrección
-            corr_table.columns[0].width = Inches(1.75)  # Intermedio para imagen
-            corr_table.columns[1].width = Inches(2.25)  # Intermedio para descripción
-            
-            # FILA 1: Título (combinar columnas)
-            title_cell = merge_cells_horizontal(corr_table, 0, 0, 1)
-            
-            # Configurar título con fondo rojo
-            title_para = title_cell.paragraphs[0]
-            title_run = title_para.add_run(corr.get("titulo", f"Corrección {i}"))
-            title_run.bold = True
-            set_font_cambria_size(title_run, 11)
-            title_run.font.color.rgb = RGBColor(255, 255, 255)  # Texto blanco
-            title_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            set_cell_vertical_alignment(title_cell, 'center')
-            
-            # Aplicar fondo rojo al título
-            tc_title = title_cell._tc
-            tcPr_title = tc_title.get_or_add_tcPr()
-            shd_title = OxmlElement('w:shd')
-            shd_title.set(qn('w:val'), 'clear')
-            shd_title.set(qn('w:color'), 'auto')
-            shd_title.set(qn('w:fill'), 'E30613')  # Rojo
-            tcPr_title.append(shd_title)
-            
-            # FILA 2: Imagen en columna 1
-            img_cell = corr_table.rows[1].cells[0]
-            set_cell_vertical_alignment(img_cell, 'center')
-            
-            if corr.get("imagen"):
-                img_abs = os.path.join(app.root_path, corr["imagen"].lstrip("/"))
+    except Exception:
+        # Fallback simple
+        footer_run = footer_para.add_run(opts["text"].strip())
+        set_font(footer_run, style["font"], opts["size"])
+
+# --- Layout declarativo (layouts/<nombre>.json) compilado a un plan de construcción ---
+
+def _hex_color(value):
+    value = str(value).lstrip("#").upper()
+    if not re.fullmatch(r"[0-9A-F]{6}", value):
+        raise ValueError(f"Color inválido: {value}")
+    return value
+
+def _inches(values, count):
+    if not isinstance(values, list) or len(values) != count:
+        raise ValueError(f"Se esperaban {count} anchos: {values}")
+    return [Inches(float(v)) for v in values]
+
+def compile_style(spec):
+    """Normaliza los estilos globales una sola vez (colores, RGBColor, tamaños)"""
+    style = dict(spec)
+    style.setdefault("font", "Cambria")
+    style["logo"] = os.path.join(app.root_path, style.get("logo", "static/img/logo.png"))
+    style["accent"] = _hex_color(style.get("accent", "E30613"))
+    style["accent_text"] = RGBColor.from_string(_hex_color(style.get("accent_text", "FFFFFF")))
+    style["muted"] = _hex_color(style.get("muted", "F5F5F5"))
+    style["title_size"] = float(style.get("title_size", 12))
+    style["text_size"] = float(style.get("text_size", 10))
+    return style
+
+def _compile_block(block, plan):
+    """Traduce un bloque del spec a un paso (document, data, style) con sus opciones ya resueltas"""
+    kind = block.get("type")
+    fragments, field_tags = plan.fragments, plan.field_tags
+    if kind == "spacer":
+        return lambda document, data, style: document.add_paragraph()
+    if kind == "section_title":
+        text, tag = str(block["text"]), block.get("tag")
+        return lambda document, data, style: add_section_title(document, text, style, tag)
+    if kind == "header":
+        opts = dict(block, tag=block.get("tag", "encabezado"), field=block.get("field", "fecha"),
+                    widths=_inches(block["widths"], 3), height=Inches(float(block["height"])),
+                    logo_height=Inches(float(block["logo_height"])))
+        fragments[opts["tag"]] = lambda document, data, style: add_report_header(document, data, style, opts)
+        field_tags[opts["field"]] = opts["tag"]
+        return fragments[opts["tag"]]
+    if kind == "fields":
+        opts = dict(block, tag=block.get("tag", "datos"), widths=_inches(block["widths"], 2),
+                    rows=[(str(r["label"]), r["field"]) for r in block["rows"]],
+                    fills=[_hex_color(f) for f in block["fills"]])
+        fragments[opts["tag"]] = lambda document, data, style: add_datos_generales(document, data, style, opts)
+        for _, field in opts["rows"]:
+            field_tags[field] = opts["tag"]
+        return fragments[opts["tag"]]
+    if kind == "conditions":
+        opts = dict(block, field=block.get("field", "condiciones"), columns=int(block.get("columns", 3)),
+                    compact_threshold=int(block.get("compact_threshold", 40)),
+                    width=Inches(float(block.get("width", 6.0))), size=float(block.get("size", 9)))
+        if opts["columns"] < 1:
+            raise ValueError("columns debe ser al menos 1")
+        plan.checklist = opts
+        fragments["condicion"] = add_condition
+        def step(document, data, style):
+            condiciones = data.get(opts["field"]) or []
+            if condiciones and plan.checklist_mode(data) == "compacto":
+                add_checklist_table(document, condiciones, style, opts)
+                return
+            for c in condiciones:
+                add_condition(document, c, style)
+        fragments["condiciones"] = step
+        return step
+    if kind == "corrections":
+        field = block.get("field", "correcciones")
+        opts = dict(block, widths=_inches(block["widths"], 2), image_width=Inches(float(block["image_width"])))
+        fragments["correccion"] = lambda document, corr, i, style: add_correction(document, corr, i, style, opts)
+        return lambda document, data, style: add_corrections(document, data.get(field) or [], style, opts)
+    if kind == "footer":
+        opts = dict(block)
+        return lambda document, data, style: add_page_footer(document, style, opts)
+    raise ValueError(f"Tipo de bloque desconocido: {kind}")
+
+class LayoutPlan:
+    """Layout compilado: lista de pasos y builders de fragmentos para editar reportes"""
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.style = compile_style(spec.get("styles", {}))
+        self.fragments = {}
+        # Campo del formulario -> tabla que lo muestra (para regenerar solo esa tabla)
+        self.field_tags = {}
+        # Opciones del bloque de condiciones (modo checklist compacto)
+        self.checklist = None
+        self.steps = [_compile_block(block, self) for block in spec["blocks"]]
+        # Alturas a las que se dibuja el logo (para precargarlo ya reducido)
+        self.logo_heights = [Inches(float(b["logo_height"])) for b in spec["blocks"] if b.get("type") == "header"]
+
+    def build(self, data, style=None):
+        style = style or self.style
+        document = new_document()
+        for step in self.steps:
+            step(document, data, style)
+        return document
+
+    def checklist_mode(self, data):
+        """"compacto" (una tabla en columnas) o "lista" (un párrafo por condición)"""
+        if self.checklist is None:
+            return "lista"
+        mode = data.get("checklist")
+        if mode in ("compacto", "lista"):
+            return mode
+        count = len(data.get(self.checklist["field"]) or [])
+        return "compacto" if count > self.checklist["compact_threshold"] else "lista"
+
+    def fragment(self, tag, document, *args, style=None):
+        """Construye un solo fragmento (al final del cuerpo) con el mismo layout"""
+        if tag not in self.fragments:
+            raise ValueError(f"El layout '{self.name}' no tiene fragmento '{tag}'")
+        return self.fragments[tag](document, *args, style or self.style)
+
+class LayoutRegistry:
+    """Planes compilados por nombre de layout, recompilados si el JSON cambia (mtime)"""
+
+    def __init__(self, folder, default, check_interval):
+        self.folder = folder
+        self.default = default
+        self.check_interval = check_interval
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        try:
+            return sorted(f[:-5] for f in os.listdir(self.folder) if f.endswith(".json"))
+        except OSError:
+            return []
+
+    def load(self):
+        for name in self.names():
+            self.get(name)
+
+    def plans(self):
+        return [entry["plan"] for entry in list(self._plans.values())]
+
+    def get(self, name=None):
+        name = name or self.default
+        entry = self._plans.get(name)
+        # Revisar el mtime como mucho cada check_interval segundos
+        if entry and time.monotonic() - entry["checked"] < self.check_interval:
+            return entry["plan"]
+        if not re.fullmatch(r"[a-z0-9_-]+", name):
+            raise KeyError(name)
+        with self._lock:
+            path = os.path.join(self.folder, name + ".json")
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                if entry:
+                    return entry["plan"]
+                raise KeyError(name)
+            if entry is None or entry["mtime"] != mtime:
                 try:
-                    img_para = img_cell.paragraphs[0]
-                    img_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                    # Tamaño intermedio de imagen
-                    img_para.add_run().add_picture(img_abs, width=Inches(1.55))
-                except Exception:
-                    error_para = img_cell.paragraphs[0]
-                    error_run = error_para.add_run("(No se pudo insertar la imagen)")
-                    set_font_cambria_10(error_run)
-                    error_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+                    with open(path, encoding="utf-8") as fh:
+                        plan = LayoutPlan(name, json.load(fh))
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    # Un spec con errores no tumba los reportes: se sigue usando el plan anterior
+                    if entry is None:
+                        raise
+                    app.logger.error("Layout %s inválido, se mantiene la versión anterior: %s", name, e)
+                    plan = entry["plan"]
+                entry = {"plan": plan, "mtime": mtime}
+                self._plans[name] = entry
+            entry["checked"] = time.monotonic()
+            return entry["plan"]
+
+_layouts = LayoutRegistry(app.config["LAYOUT_FOLDER"], app.config["LAYOUT_DEFAULT"],
+                          app.config["LAYOUT_CHECK_INTERVAL"])
+
+class BrandingRegistry:
+    """Marca (logo y colores) por sitio o cliente, con logos ya reducidos en un LRU en memoria.
+
+    branding.json: {"sitios": {"<sitio>": {...}}, "clientes": {"<cliente>": {...}}} donde cada
+    marca puede definir logo, accent, accent_text, muted y font. Lo que no define se toma del layout.
+    """
+
+    STYLE_KEYS = ("logo", "accent", "accent_text", "muted", "font")
+
+    def __init__(self, path, site, logo_dpi, cache_size, check_interval):
+        self.path = path
+        self.site = site
+        self.logo_dpi = logo_dpi
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+        self._brands = {}
+        self._mtime = None
+        self._checked = None
+        self._logos = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _compile(self, brand):
+        overrides = {k: v for k, v in brand.items() if k in self.STYLE_KEYS}
+        if "logo" in overrides:
+            overrides["logo"] = os.path.join(app.root_path, overrides["logo"])
+        for key in ("accent", "muted"):
+            if key in overrides:
+                overrides[key] = _hex_color(overrides[key])
+        if "accent_text" in overrides:
+            overrides["accent_text"] = RGBColor.from_string(_hex_color(overrides["accent_text"]))
+        return overrides
+
+    def _refresh(self):
+        """Relee branding.json si cambió (revisando el mtime como mucho cada check_interval)"""
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                self._brands, self._mtime = {}, None
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, encoding="utf-8") as fh:
+                    spec = json.load(fh)
+                brands = {}
+                for kind, prefix in (("sitios", "sitio"), ("clientes", "cliente")):
+                    for name, brand in (spec.get(kind) or {}).items():
+                        brands[f"{prefix}:{ReportIndex.normalize(name)}"] = self._compile(brand)
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                app.logger.error("branding.json inválido, se mantiene la versión anterior: %s", e)
+                return
+            self._brands, self._mtime = brands, mtime
+
+    def resolve(self, cliente, host=None):
+        """Clave de marca para un reporte: cliente, luego sitio; None = estilo del layout"""
+        self._refresh()
+        for key in (f"cliente:{ReportIndex.normalize(cliente)}",
+                    f"sitio:{ReportIndex.normalize(self.site or (host or '').split(':')[0])}"):
+            if key in self._brands:
+                return key
+        return None
+
+    def style(self, base, key):
+        """Estilo del layout con los valores de la marca aplicados encima"""
+        self._refresh()
+        overrides = self._brands.get(key) if key else None
+        return dict(base, **overrides) if overrides else base
+
+    def logo(self, path, height):
+        """PNG del logo reducido a la altura de impresión; se decodifica una vez por versión del archivo"""
+        if not path:
+            return None
+        cache_key = (path, round(height.inches * self.logo_dpi))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._logos.get(cache_key)
+            if entry:
+                self._logos.move_to_end(cache_key)
+                if now - entry["checked"] < self.check_interval:
+                    return entry["data"]
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        if entry is None or entry["mtime"] != mtime:
+            try:
+                entry = {"data": self._resize_logo(path, cache_key[1]), "mtime": mtime}
+            except (OSError, ValueError) as e:
+                app.logger.error("No se pudo cargar el logo %s: %s", path, e)
+                return None
+        entry["checked"] = now
+        with self._lock:
+            self._logos[cache_key] = entry
+            self._logos.move_to_end(cache_key)
+            while len(self._logos) > self.cache_size:
+                self._logos.popitem(last=False)
+        return entry["data"]
+
+    def _resize_logo(self, path, height_px):
+        with Image.open(path) as img:
+            img.load()
+            if img.height > height_px:
+                width_px = max(1, round(img.width * height_px / img.height))
+                img = img.resize((width_px, height_px), Image.LANCZOS)
+            buf = io.BytesIO()
+            img.save(buf, "PNG", optimize=True, dpi=(self.logo_dpi, self.logo_dpi))
+        return buf.getvalue()
+
+    def load(self, base, heights):
+        """Precarga los logos del layout y de todas las marcas configuradas"""
+        self._refresh()
+        paths = {base.get("logo")} | {b["logo"] for b in self._brands.values() if "logo" in b}
+        for path in paths:
+            for height in heights:
+                self.logo(path, height)
+
+_branding = BrandingRegistry(app.config["BRANDING_FILE"], app.config["BRAND_SITE"],
+                             app.config["BRAND_LOGO_DPI"], app.config["BRAND_LOGO_CACHE"],
+                             app.config["BRANDING_CHECK_INTERVAL"])
+
+def report_layout(data):
+    """Plan de construcción y estilo (con la marca del reporte) para unos datos"""
+    plan = _layouts.get(data.get("layout"))
+    return plan, _branding.style(plan.style, data.get("marca"))
+
+def build_report_document(data):
+    """Construye el DOCX completo con el layout y la marca del reporte"""
+    plan, style = report_layout(data)
+    return plan.build(data, style)
+
+REPORT_FIELDS = ("fecha", "cliente", "equipo", "kilometraje", "horas")
+
+def report_data_path(base_name):
+    return os.path.join(app.config["GENERATED_FOLDER"], base_name + ".json")
+
+def _unique_tmp(path):
+    """Archivo temporal único junto a path (mismo sistema de archivos para os.replace)"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp")
+    os.close(fd)
+    return tmp_path
+
+def save_report_data(base_name, data):
+    """Guarda la submission estructurada junto al DOCX para poder editarlo después"""
+    tmp_path = _unique_tmp(report_data_path(base_name))
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False)
+        os.replace(tmp_path, report_data_path(base_name))
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+
+_report_locks = {}   # base_name -> Lock (uno por reporte editado en este proceso)
+_report_locks_guard = threading.Lock()
+
+@contextlib.contextmanager
+def report_lock(base_name):
+    """Serializa las ediciones de un reporte: entre hilos con un Lock y entre workers con flock"""
+    with _report_locks_guard:
+        lock = _report_locks.setdefault(base_name, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        lock_dir = os.path.join(app.config["GENERATED_FOLDER"], "locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, base_name + ".lock"), "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+def load_report_data(base_name):
+    try:
+        with open(report_data_path(base_name), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+def _body_fragments(document, tag):
+    return [el for el in document.element.body.iterchildren() if fragment_tag(el) == tag]
+
+def _condition_paragraphs(document):
+    """Párrafos de condiciones: entre los títulos de CONDICIONES y CORRECCIONES"""
+    start = _body_fragments(document, "seccion:condiciones")[0]
+    paragraphs = []
+    for el in start.itersiblings():
+        if fragment_tag(el) == "seccion:correcciones":
+            return paragraphs, el
+        paragraphs.append(el)
+    raise ValueError("Estructura de reporte no reconocida")
+
+def _detach(element):
+    """Saca un fragmento recién construido (al final del cuerpo) para moverlo"""
+    element.getparent().remove(element)
+    return element
+
+def _spacer(document):
+    return _detach(document.add_paragraph()._p)
+
+def _index(op, items, inserting=False):
+    index = op.get("index", len(items) if inserting else None)
+    limit = len(items) + 1 if inserting else len(items)
+    if not isinstance(index, int) or not 0 <= index < limit:
+        raise ValueError(f"Índice fuera de rango: {index}")
+    return index
+
+def _patch_field(document, data, op):
+    field = op.get("field")
+    if field not in REPORT_FIELDS:
+        raise ValueError(f"Campo desconocido: {field}")
+    data[field] = str(op.get("value") or "").strip()
+    # Solo se regenera la tabla que contiene el campo
+    plan, style = report_layout(data)
+    tag = plan.field_tags.get(field)
+    if tag is None:
+        raise ValueError(f"El layout '{plan.name}' no muestra el campo {field}")
+    old = _body_fragments(document, tag)[0]
+    old.addprevious(_detach(plan.fragment(tag, document, data, style=style)._tbl))
+    old.getparent().remove(old)
+
+def _patch_condition(document, data, op):
+    condiciones = data["condiciones"]
+    plan, style = report_layout(data)
+    paragraphs, next_section = _condition_paragraphs(document)
+    action = op["op"]
+    if action == "add":
+        index = _index(op, condiciones, inserting=True)
+        cond = {"text": str(op["value"].get("text", "")).strip(), "checked": bool(op["value"].get("checked"))}
+        if op["value"].get("category"):
+            cond["category"] = str(op["value"]["category"]).strip()
+        if not cond["text"]:
+            raise ValueError("La condición necesita texto")
+        condiciones.insert(index, cond)
+    else:
+        index = _index(op, condiciones)
+        if action == "remove":
+            del condiciones[index]
+        elif action == "modify":
+            cond = dict(condiciones[index], **{k: v for k, v in op["value"].items() if k in ("text", "checked", "category")})
+            condiciones[index] = cond
+        else:
+            raise ValueError(f"Operación desconocida: {action}")
+
+    # Checklist compacto (antes o después del cambio): se reconstruye la tabla completa
+    if plan.checklist_mode(data) == "compacto" or any(fragment_tag(el) == "checklist" for el in paragraphs):
+        _replace_conditions(document, plan, style, data, paragraphs, next_section)
+        return
+    if action == "add":
+        anchor = paragraphs[index] if index < len(paragraphs) else next_section
+        anchor.addprevious(_detach(plan.fragment("condicion", document, cond, style=style)._p))
+        return
+    old = paragraphs[index]
+    if action == "modify":
+        old.addprevious(_detach(plan.fragment("condicion", document, cond, style=style)._p))
+    old.getparent().remove(old)
+
+def _replace_conditions(document, plan, style, data, old, next_section):
+    """Sustituye todo el bloque de condiciones por uno construido de nuevo"""
+    body = document.element.body
+    for el in old:
+        body.remove(el)
+    existing = set(body.iterchildren())
+    plan.fragment("condiciones", document, data, style=style)
+    for el in [el for el in body.iterchildren() if el not in existing]:
+        next_section.addprevious(el)
+
+def _correction_value(op, current=None):
+    value = dict(current or {})
+    for key in ("titulo", "descripcion"):
+        if key in op["value"]:
+            value[key] = str(op["value"][key] or "").strip()
+    # "imagen" nombra el campo de archivo de la petición multipart
+    if op["value"].get("imagen"):
+        value["imagen"] = save_upload(request.files.get(op["value"]["imagen"]))
+    value.setdefault("descripcion", "")
+    value.setdefault("imagen", None)
+    return value
+
+def _patch_correction(document, data, op):
+    correcciones = data["correcciones"]
+    plan, style = report_layout(data)
+    tables = _body_fragments(document, "correccion")
+    action = op["op"]
+    if action == "add":
+        index = _index(op, correcciones, inserting=True)
+        corr = _correction_value(op)
+        if not corr.get("titulo"):
+            corr["titulo"] = f"Corrección {len(correcciones) + 1}"
+        new = _detach(plan.fragment("correccion", document, corr, index + 1, style=style)._tbl)
+        # Mantener el mismo espaciado que build_report_document
+        if index < len(tables):
+            tables[index].addprevious(new)
+            new.addnext(_spacer(document))
+            new.addnext(_spacer(document))
+        elif tables:
+            trailing = tables[-1].getnext()
+            trailing.addnext(new)
+            new.addprevious(_spacer(document))
+            new.addnext(_spacer(document))
+        else:
+            gap = _body_fragments(document, "seccion:correcciones")[0].getnext()
+            gap.addnext(new)
+            new.addnext(_spacer(document))
+        correcciones.insert(index, corr)
+        return
+    index = _index(op, correcciones)
+    old = tables[index]
+    if action == "remove":
+        doomed = [old, old.getnext()]
+        if index < len(tables) - 1:
+            doomed.append(doomed[-1].getnext())
+        elif index > 0:
+            doomed.append(old.getprevious())
+        for el in doomed:
+            el.getparent().remove(el)
+        del correcciones[index]
+    elif action == "modify":
+        corr = _correction_value(op, correcciones[index])
+        old.addprevious(_detach(plan.fragment("correccion", document, corr, index + 1, style=style)._tbl))
+        old.getparent().remove(old)
+        correcciones[index] = corr
+    else:
+        raise ValueError(f"Operación desconocida: {action}")
+
+def _drop_unused_images(document):
+    """Elimina relaciones a imágenes que ya no se usan (y con ellas sus partes media)"""
+    part = document.part
+    used = set(document.element.body.xpath('.//a:blip/@r:embed'))
+    for rId, rel in list(part.rels.items()):
+        if rel.reltype == RT.IMAGE and rId not in used:
+            part.drop_rel(rId)
+
+MEDIA_PREFIX = "word/media/"
+
+def _zip_raw(fp, info):
+    """Bytes de una entrada tal como están comprimidos en el archivo"""
+    fp.seek(info.header_offset)
+    name_len, extra_len = struct.unpack("<HH", fp.read(30)[26:30])
+    fp.seek(info.header_offset + 30 + name_len + extra_len)
+    return fp.read(info.compress_size)
+
+def _zip_write_raw(zf, info, raw):
+    """Agrega una entrada ya comprimida sin descomprimirla ni volver a comprimirla"""
+    zinfo = copy.copy(info)
+    zinfo.flag_bits &= ~0x08  # CRC y tamaños van en la cabecera local, sin data descriptor
+    zinfo.header_offset = zf.fp.tell()
+    zf.fp.write(zinfo.FileHeader())
+    zf.fp.write(raw)
+    zf.start_dir = zf.fp.tell()
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+    zf._didModify = True
+
+def open_report_package(docx_path):
+    """Abre un DOCX para editarlo sin cargar las imágenes.
+
+    Las partes de word/media/ se reemplazan por blobs vacíos (python-docx solo las
+    necesita por nombre y relación); devuelve el Document y el XML original por parte.
+    """
+    originals = {}
+    light = io.BytesIO()
+    with zipfile.ZipFile(docx_path) as src, zipfile.ZipFile(light, "w", zipfile.ZIP_STORED) as dst:
+        for info in src.infolist():
+            if info.filename.startswith(MEDIA_PREFIX):
+                dst.writestr(info.filename, b"")
             else:
-                # Placeholder si no hay imagen
-                no_img_para = img_cell.paragraphs[0]
-                no_img_run = no_img_para.add_run("(Sin imagen)")
-                set_font_cambria_10(no_img_run)
-                no_img_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-            
-            # FILA 2: Descripción en columna 2
-            desc_cell = corr_table.rows[1].cells[1]
-            set_cell_vertical_alignment(desc_cell, 'center')
-            
-            # Aplicar fondo gris claro a la celda de descripción
-            tc_desc = desc_cell._tc
-            tcPr_desc = tc_desc.get_or_add_tcPr()
-            shd_desc = OxmlElement('w:shd')
-            shd_desc.set(qn('w:val'), 'clear')
-            shd_desc.set(qn('w:color'), 'auto')
-            shd_desc.set(qn('w:fill'), 'F5F5F5')  # Gris claro
-            tcPr_desc.append(shd_desc)
-            
-            if corr.get("descripcion"):
-                desc_para = desc_cell.paragraphs[0]
-                desc_run = desc_para.add_run(corr.get("descripcion"))
-                set_font_cambria_10(desc_run)
-                desc_para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY  # Justificar texto
+                originals[info.filename] = src.read(info)
+                dst.writestr(info.filename, originals[info.filename])
+    return Document(light), originals
+
+def save_report_package(document, docx_path, originals, out_path):
+    """Escribe el DOCX editado copiando sin recomprimir las partes que no cambiaron.
+
+    Solo se comprimen las partes XML modificadas y las imágenes nuevas; las imágenes
+    que ya no se usan quedan fuera porque python-docx no las vuelve a escribir.
+    """
+    patched_buf = io.BytesIO()
+    document.save(patched_buf)
+    with zipfile.ZipFile(patched_buf) as patched, zipfile.ZipFile(docx_path) as src, \
+            zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as dst:
+        for info in patched.infolist():
+            name = info.filename
+            blob = patched.read(info)
+            original = src.NameToInfo.get(name)
+            unchanged = blob == originals.get(name) or (name.startswith(MEDIA_PREFIX) and not blob)
+            if original is not None and unchanged:
+                _zip_write_raw(dst, original, _zip_raw(src.fp, original))
             else:
-                # Placeholder si no hay descripción
-                no_desc_para = desc_cell.paragraphs[0]
-                no_desc_run = no_desc_para.add_run("(Sin descripción)")
-                set_font_cambria_10(no_desc_run)
-                no_desc_para.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
-            
-            # Aplicar solo bordes exteriores gruesos
-            add_thick_outer_borders_only(corr_table)
-            
-            # Espacio después de cada tabla de corrección
-            document.add_paragraph()
+                # Las imágenes ya están comprimidas: guardarlas sin deflate
+                compress = zipfile.ZIP_STORED if name.startswith(MEDIA_PREFIX) else zipfile.ZIP_DEFLATED
+                dst.writestr(name, blob, compress_type=compress)
 
-        # Footer with page number field (centered)
-        section = document.sections[0]
-        footer = section.footer
-        footer_para = footer.paragraphs[0] if footer.paragraphs else footer.add_paragraph()
-        footer_para.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-        
-        # Crear footer con campo PAGE dinámico
+def apply_report_edits(base_name, ops):
+    """Aplica cambios a un reporte existente regenerando solo los fragmentos afectados.
+
+    El costo depende del cambio y no del tamaño del reporte: las imágenes no se leen
+    ni se recomprimen. Quien llama debe tener report_lock(base_name).
+    """
+    data = load_report_data(base_name)
+    docx_path = os.path.join(app.config["GENERATED_FOLDER"], base_name + ".docx")
+    if data is None or not os.path.exists(docx_path):
+        raise FileNotFoundError(base_name)
+
+    document, originals = open_report_package(docx_path)
+    for op in ops:
+        if op.get("op") == "set":
+            _patch_field(document, data, op)
+        elif op.get("target") == "condicion":
+            _patch_condition(document, data, op)
+        elif op.get("target") == "correccion":
+            _patch_correction(document, data, op)
+        else:
+            raise ValueError(f"Operación no soportada: {op}")
+    _drop_unused_images(document)
+
+    tmp_path = _unique_tmp(docx_path)
+    try:
+        save_report_package(document, docx_path, originals, tmp_path)
+        os.replace(tmp_path, docx_path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    save_report_data(base_name, data)
+    return data
+
+def _is_token(value):
+    """Ids generados por el cliente o el servidor: solo hex y guiones"""
+    return bool(value) and len(value) <= 64 and all(ch in "0123456789abcdef-" for ch in value)
+
+def _submission_marker(submission_id):
+    return os.path.join(app.config["GENERATED_FOLDER"], "submissions", submission_id)
+
+def find_submission(submission_id):
+    """Devuelve el reporte ya generado para un submission_id (reintentos offline)"""
+    if not _is_token(submission_id):
+        return None
+    try:
+        with open(_submission_marker(submission_id), encoding="utf-8") as fh:
+            base_name = fh.read().strip()
+    except OSError:
+        return None
+    if not os.path.exists(os.path.join(app.config["GENERATED_FOLDER"], base_name + ".docx")):
+        return None
+    return base_name
+
+def remember_submission(submission_id, base_name):
+    if not _is_token(submission_id):
+        return
+    os.makedirs(os.path.dirname(_submission_marker(submission_id)), exist_ok=True)
+    with open(_submission_marker(submission_id), "w", encoding="utf-8") as fh:
+        fh.write(base_name)
+
+def _draft_path(draft_id):
+    return os.path.join(app.config["UPLOAD_FOLDER"], "drafts", f"{draft_id}.json")
+
+def save_draft(data):
+    """Guarda los datos ya procesados para confirmar la generación sin re-subir imágenes"""
+    draft_id = uuid.uuid4().hex
+    os.makedirs(os.path.dirname(_draft_path(draft_id)), exist_ok=True)
+    with open(_draft_path(draft_id), "w", encoding="utf-8") as fh:
+        json.dump(data, fh, ensure_ascii=False)
+    return draft_id
+
+def claim_draft(draft_id):
+    """Toma un borrador para generarlo (rename atómico): un doble envío no lo procesa dos veces.
+
+    Devuelve (datos, ruta reclamada), o (None, None) si no existe, ya fue tomado o el id no es válido.
+    """
+    if not _is_token(draft_id):
+        return None, None
+    claimed = _draft_path(draft_id) + ".claimed"
+    try:
+        os.rename(_draft_path(draft_id), claimed)
+    except OSError:
+        return None, None
+    try:
+        with open(claimed, encoding="utf-8") as fh:
+            return json.load(fh), claimed
+    except (OSError, ValueError):
+        _remove_quietly(claimed)
+        return None, None
+
+def release_draft(claimed, used):
+    """Borra el borrador ya generado, o lo devuelve para poder reintentar"""
+    if not claimed:
+        return
+    if used:
+        _remove_quietly(claimed)
+    else:
+        os.replace(claimed, claimed[:-len(".claimed")])
+
+_preview_cleanup = {"last": None}
+
+def cleanup_previews(force=False):
+    """Borra borradores y miniaturas de vista previa más viejos que PREVIEW_MAX_AGE.
+
+    Las imágenes de un borrador que nunca se confirmó no las usa ningún reporte y se
+    borran con él. Se ejecuta como mucho una vez por hora por proceso.
+    """
+    now = time.monotonic()
+    if not force and _preview_cleanup["last"] is not None and now - _preview_cleanup["last"] < 3600:
+        return
+    _preview_cleanup["last"] = now
+    cutoff = time.time() - app.config["PREVIEW_MAX_AGE"]
+    drafts_dir = os.path.join(app.config["UPLOAD_FOLDER"], "drafts")
+    for path in glob.glob(os.path.join(drafts_dir, "*.json")) + glob.glob(os.path.join(drafts_dir, "*.claimed")):
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            with open(path, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            data = {}
+        if path.endswith(".json"):
+            for corr in data.get("correcciones", []):
+                if corr.get("imagen"):
+                    _remove_quietly(os.path.join(app.config["UPLOAD_FOLDER"], corr["imagen"].rsplit("/", 1)[-1]))
+        _remove_quietly(path)
+    for path in glob.glob(os.path.join(app.config["UPLOAD_FOLDER"], "thumbs", "*")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def make_thumbnail(img_rel_path):
+    """Miniatura JPEG de una imagen subida (se reutiliza si ya existe)"""
+    if not img_rel_path:
+        return None
+    filename = img_rel_path.rsplit("/", 1)[-1]
+    thumb_name = os.path.splitext(filename)[0] + ".jpg"
+    thumb_path = os.path.join(app.config["UPLOAD_FOLDER"], "thumbs", thumb_name)
+    if not os.path.exists(thumb_path):
+        size = app.config["PREVIEW_THUMB_PX"]
         try:
-            # Texto "Página "
-            run1 = footer_para.add_run("Página ")
-            set_font_cambria_size(run1, 9)
-            
-            # Campo PAGE dinámico
-            run2 = footer_para.add_run()
-            fldChar1 = OxmlElement('w:fldChar')
-            fldChar1.set(qn('w:fldCharType'), 'begin')
-            
-            instrText = OxmlElement('w:instrText')
-            instrText.text = 'PAGE'
-            
-            fldChar2 = OxmlElement('w:fldChar')
-            fldChar2.set(qn('w:fldCharType'), 'end')
-            
-            run2._r.append(fldChar1)
-            run2._r.append(instrText)
-            run2._r.append(fldChar2)
-            set_font_cambria_size(run2, 9)
-            
+            with Image.open(os.path.join(app.config["UPLOAD_FOLDER"], filename)) as img:
+                # draft() permite a JPEG decodificar directamente a menor resolución
+                img.draft("RGB", (size, size))
+                img.thumbnail((size, size))
+                os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+                img.convert("RGB").save(thumb_path, "JPEG", quality=80)
         except Exception:
-            # Fallback simple
-            footer_run = footer_para.add_run("Página")
-            set_font_cambria_size(footer_run, 9)
+            return img_rel_path
+    return f"/uploads/thumbs/{thumb_name}"
 
-        document.save(docx_path)
+def _pdf_link_callback(uri, rel):
+    """Resuelve rutas /uploads y /static a archivos locales (sin red)"""
+    if uri.startswith("/uploads/") or uri.startswith("/static/"):
+        return os.path.join(app.root_path, uri.lstrip("/"))
+    return uri
+
+def _convert_pdf(html, pdf_path):
+    """Convierte el HTML de report.html a PDF (se ejecuta en el pool de fondo)"""
+    start = time.perf_counter()
+    # Único: una edición puede reprogramar el PDF mientras otra conversión sigue en curso
+    tmp_path = _unique_tmp(pdf_path)
+    try:
+        with open(tmp_path, "wb") as fh:
+            result = pisa.CreatePDF(html, dest=fh, link_callback=_pdf_link_callback)
+        if result.err:
+            raise RuntimeError(f"xhtml2pdf reportó {result.err} errores")
+        os.replace(tmp_path, pdf_path)
     except Exception as e:
-        flash(f"Error generando DOCX: {e}", "danger")
-        return redirect(url_for("index"))
+        app.logger.exception("Error generando PDF %s", pdf_path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        # Marca de fallo: /pdf-status deja de reportar "pendiente"
+        with open(pdf_path + ".failed", "w", encoding="utf-8") as fh:
+            fh.write(str(e))
+        with _metrics_lock:
+            _metrics["pdf"]["failed"] += 1
+        return
+    finally:
+        _remove_quietly(pdf_path + ".pending")
+    elapsed = time.perf_counter() - start
+    with _metrics_lock:
+        _metrics["pdf"]["generated"] += 1
+        _metrics["pdf"]["total_seconds"] += elapsed
+        _metrics["pdf"]["last_seconds"] = round(elapsed, 4)
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def pdf_state(pdf_path):
+    """"ready", "pending" o "failed" según el PDF y sus marcas .pending/.failed"""
+    if os.path.exists(pdf_path):
+        return "ready"
+    if os.path.exists(pdf_path + ".failed"):
+        return "failed"
+    try:
+        age = time.time() - os.path.getmtime(pdf_path + ".pending")
+    except OSError:
+        return "failed"  # nunca se encoló (o la marca se perdió)
+    # Un worker que muere con la conversión en cola deja la marca sin resolver
+    return "pending" if age < app.config["PDF_PENDING_TIMEOUT"] else "failed"
+
+def schedule_pdf(data, base_name):
+    """Encola la conversión a PDF junto al DOCX; devuelve el nombre o None"""
+    if pisa is None or data is None:
+        return None
+    pdf_filename = base_name + ".pdf"
+    pdf_path = os.path.join(app.config["GENERATED_FOLDER"], pdf_filename)
+    state = pdf_state(pdf_path)
+    if state == "ready" or (state == "pending" and os.path.exists(pdf_path + ".pending")):
+        # Ya está en caché junto al DOCX, o su conversión sigue en curso
+        return pdf_filename
+    html = render_template("report.html",
+                           generated_at=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+                           **data)
+    _remove_quietly(pdf_path + ".failed")
+    open(pdf_path + ".pending", "w").close()
+    _pdf_executor.submit(_convert_pdf, html, pdf_path)
+    return pdf_filename
+
+@app.route("/")
+def index():
+    hoy = datetime.date.today().isoformat()
+    # Con avisos flash la página no es el shell limpio: el service worker no la guarda en caché
+    has_flashes = bool(session.get("_flashes"))
+    response = make_response(render_template("form.html", today=hoy))
+    if has_flashes:
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/submit", methods=["POST"])
+def submit():
+    ensure_dirs()
+    timer = g.stage_timer = StageTimer((request.headers.get("X-Request-ID") or "")[:64] or uuid.uuid4().hex)
+    # Reintento de un envío ya procesado (cola offline del service worker). Al confirmar
+    # una vista previa el draft_id hace de submission_id (doble clic, volver atrás)
+    draft_id = request.form.get("draft_id", "").strip().lower()
+    submission_id = request.form.get("submission_id", "").strip().lower() or draft_id
+    base_name = find_submission(submission_id)
+    timer.mark("dedupe")
+    if base_name:
+        # Solo se informa un PDF que existe o que se está generando (se reintenta si falló)
+        return submit_response(base_name + ".docx", schedule_pdf(load_report_data(base_name), base_name))
+
+    # Control de admisión antes de leer y guardar las imágenes: un 503 no deja
+    # archivos huérfanos en uploads/ y se rechaza rápido en vez de acumular timeouts
+    client = client_key()
+    rejected = _admission.acquire(client)
+    timer.mark("admission")
+    if rejected:
+        return submit_error("El servidor está ocupado generando otros reportes. "
+                            "Intenta de nuevo en unos segundos.",
+                            503, {"Retry-After": str(_admission.retry_after())})
+
+    start = time.perf_counter()
+    try:
+        # Si viene de la vista previa, reutilizar los datos e imágenes ya guardados
+        # (las imágenes descartadas ya se mostraron en la vista previa)
+        draft = None
+        rejected_images = []
+        if draft_id:
+            data, draft = claim_draft(draft_id)
+            if data is None:
+                return submit_error("Este reporte ya se está generando o la vista previa expiró. "
+                                    "Vuelve al formulario para generarlo de nuevo.", 409)
+        else:
+            data, rejected_images = collect_submission()
+        timer.mark("parse")
+        timer.info.update(
+            conditions=len(data["condiciones"]),
+            corrections=len(data["correcciones"]),
+            images=sum(1 for c in data["correcciones"] if c.get("imagen")),
+            upload_bytes=request.content_length or 0,
+        )
+
+        base_name = reserve_report_name()
+        docx_path = os.path.join(app.config["GENERATED_FOLDER"], base_name + ".docx")
 
-    # Result page - solo DOCX por ahora
+        # --- Generar DOCX con estilo corporativo CORREGIDO ---
+        try:
+            document = build_report_document(data)
+            timer.mark("build")
+            document.save(docx_path)
+            save_report_data(base_name, data)
+            remember_submission(submission_id, base_name)
+            timer.mark("save")
+        except Exception as e:
+            release_draft(draft, used=False)
+            _remove_quietly(docx_path)
+            if wants_json():
+                return submit_error(f"Error generando DOCX: {e}", 500)
+            flash(f"Error generando DOCX: {e}", "danger")
+            return redirect(url_for("index"))
+    finally:
+        _admission.release(client, time.perf_counter() - start)
+    release_draft(draft, used=True)
+    timer.info.update(report=base_name, output_bytes=os.path.getsize(docx_path))
+
+    _autocomplete.add_submission(base_name, data)
+    _autocomplete.save(force=False)
+    _equipment.add_submission(base_name, data)
+    _equipment.save(force=False)
+    timer.mark("index")
+
+    # El PDF se genera en segundo plano para no retrasar la respuesta del DOCX
     docx_filename = os.path.basename(docx_path)
+    pdf_filename = schedule_pdf(data, base_name)
+    timer.mark("pdf_schedule")
     
+    return submit_response(docx_filename, pdf_filename, rejected_images)
+
+@app.after_request
+def log_slow_submit(response):
+    """Una línea JSON por cada submit que supera SLOW_REQUEST_SECONDS"""
+    timer = g.pop("stage_timer", None)
+    if timer is None:
+        return response
+    response.headers["X-Request-ID"] = timer.request_id
+    if timer.elapsed() >= app.config["SLOW_REQUEST_SECONDS"]:
+        timer.mark("response")
+        with _metrics_lock:
+            _metrics["slow_requests"] += 1
+        slow_request_logger().info(json.dumps(timer.record(response.status_code), ensure_ascii=False))
+    return response
+
+def wants_json():
+    """El cliente (reenvío del service worker) pidió la respuesta en JSON"""
+    return request.accept_mimetypes.best == "application/json"
+
+def submit_error(message, status, headers=None):
+    """Error de /submit: JSON para el service worker, texto plano para el navegador"""
+    if wants_json():
+        return {"status": "error", "message": message}, status, headers or {}
+    return message, status, headers or {}
+
+def reserve_report_name():
+    """Reserva un nombre único reporte_mantenimiento_AAAAMMDD_HHMMSS[_n].
+
+    Con generaciones concurrentes dos envíos del mismo segundo no deben pisarse: el
+    DOCX se crea vacío con O_EXCL y, si ya existe, se prueba con el sufijo siguiente.
+    """
+    ts_base = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    for n in itertools.count(1):
+        base_name = f"reporte_mantenimiento_{ts_base}" + (f"_{n}" if n > 1 else "")
+        try:
+            fd = os.open(os.path.join(app.config["GENERATED_FOLDER"], base_name + ".docx"),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        return base_name
+
+def submit_response(docx_filename, pdf_filename, rejected_images=()):
+    """Página de resultado, o JSON para los reenvíos del service worker"""
+    if wants_json():
+        return {"status": "ok", "docx_file": docx_filename, "pdf_file": pdf_filename,
+                "docx_url": url_for("generated_files", filename=docx_filename),
+                "rejected_images": list(rejected_images)}
     return render_template("result.html", 
                          docx_file=docx_filename, 
-                         pdf_file=None)
+                         pdf_file=pdf_filename,
+                         rejected_images=rejected_images)
+
+@app.route("/autocomplete")
+def autocomplete():
+    """Sugerencias por prefijo para cliente, equipo o condicion"""
+    field = request.args.get("field", "")
+    prefix = request.args.get("q", "")
+    limit = min(request.args.get("limit", 8, type=int), 20)
+    if not _warm_state["ready"]:
+        warmup()
+    try:
+        suggestions = _autocomplete.suggest(field, prefix, limit)
+    except KeyError:
+        return {"status": "error", "message": f"Campo no soportado: {field}"}, 400
+    return {"field": field, "q": prefix, "suggestions": suggestions}
+
+@app.route("/equipos")
+def equipos():
+    """Resumen de todos los equipos con historial"""
+    if not _warm_state["ready"]:
+        warmup()
+    return {"equipos": _equipment.summaries()}
+
+@app.route("/equipos/<path:equipo>")
+def equipo_historial(equipo):
+    """Línea de tiempo y agregados de un equipo"""
+    if not _warm_state["ready"]:
+        warmup()
+    history = _equipment.history(equipo)
+    if history is None:
+        return {"status": "error", "message": "Equipo sin historial"}, 404
+    return history
+
+@app.cli.command("backfill-equipos")
+@click.option("--folder", default=None, help="Carpeta con los DOCX (por defecto generated/)")
+def backfill_equipos(folder):
+    """Carga en el historial de equipos los reportes existentes en generated/."""
+    folder = folder or app.config["GENERATED_FOLDER"]
+    # Solo el snapshot: los reportes se recorren aquí para contar los que realmente se agregan
+    _equipment.load(None)
+    added = present = skipped = 0
+    for docx_path in sorted(glob.glob(os.path.join(folder, "reporte_*.docx"))):
+        report_id = os.path.splitext(os.path.basename(docx_path))[0]
+        if report_id in _equipment:
+            present += 1
+            continue
+        data = load_report_data(report_id) if folder == app.config["GENERATED_FOLDER"] else None
+        try:
+            data = data or extract_report_data(docx_path)
+        except Exception as e:
+            click.echo(f"{report_id}: no se pudo leer ({e})")
+            skipped += 1
+            continue
+        if not data.get("equipo"):
+            skipped += 1
+            continue
+        if _equipment.add_submission(report_id, data, ts=os.path.getmtime(docx_path)):
+            added += 1
+        else:
+            present += 1
+    _equipment.save()
+    click.echo(f"{added} reportes agregados, {present} ya estaban en el historial, "
+               f"{skipped} sin equipo o ilegibles")
+
+@app.cli.command("bench-checklist")
+@click.option("--items", default=200, help="Cantidad de condiciones")
+@click.option("--categories", default=6, help="Categorías entre las que se reparten")
+@click.option("--repeat", default=5, help="Repeticiones por modo")
+def bench_checklist(items, categories, repeat):
+    """Compara la construcción del checklist en modo lista y en modo compacto."""
+    warmup()
+    plan = _layouts.get()
+    condiciones = [{"text": f"Punto de inspección {i + 1}", "checked": i % 3 != 0,
+                    "category": f"Sistema {i % categories + 1}"} for i in range(items)]
+    for mode in ("lista", "compacto"):
+        data = {"fecha": "", "cliente": "", "equipo": "", "kilometraje": "", "horas": "",
+                "condiciones": condiciones, "correcciones": [], "checklist": mode}
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            document = plan.build(data)
+            times.append(time.perf_counter() - start)
+        buf = io.BytesIO()
+        document.save(buf)
+        # Líneas que ocupa el bloque de condiciones (lo que determina el largo del documento)
+        paragraphs, _ = _condition_paragraphs(document)
+        lines = sum(len(el.findall(qn("w:tr"))) if el.tag == qn("w:tbl") else 1 for el in paragraphs)
+        click.echo(f"{mode:>9}: {min(times) * 1000:8.1f} ms (mejor de {repeat}), "
+                   f"{lines} líneas de checklist, {len(buf.getvalue()) / 1024:.0f} KB")
+
+@app.route("/sw.js")
+def service_worker():
+    """Service worker servido desde la raíz para controlar toda la app"""
+    response = send_from_directory(os.path.join(app.root_path, "static", "js"), "sw.js")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Service-Worker-Allowed"] = "/"
+    return response
+
+@app.route("/preview", methods=["POST"])
+def preview():
+    """Vista previa HTML rápida del reporte antes de construir el DOCX"""
+    ensure_dirs()
+    cleanup_previews()
+    data, rejected_images = collect_submission()
+    draft_id = save_draft(data)
+    correcciones = [dict(c, imagen=make_thumbnail(c["imagen"])) for c in data["correcciones"]]
+    return render_template("report.html",
+                           preview=True,
+                           draft_id=draft_id,
+                           rejected_images=rejected_images,
+                           generated_at=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+                           **dict(data, correcciones=correcciones))
+
+@app.route("/reports/<base_name>/edit", methods=["POST"])
+def edit_report(base_name):
+    """Edita un reporte existente: ops JSON en el cuerpo o en el campo "ops" (multipart)"""
+    base_name = secure_filename(base_name)
+    payload = request.get_json(silent=True)
+    if payload is None:
+        try:
+            payload = {"ops": json.loads(request.form.get("ops", "[]"))}
+        except ValueError:
+            return {"status": "error", "message": "ops no es JSON válido"}, 400
+    ops = payload.get("ops") if isinstance(payload, dict) else payload
+    if not isinstance(ops, list) or not ops:
+        return {"status": "error", "message": "Se requiere una lista de operaciones"}, 400
+
+    start = time.perf_counter()
+    # Dos ediciones simultáneas del mismo reporte (hilos o workers) se aplican una tras otra
+    with report_lock(base_name):
+        previous = load_report_data(base_name)
+        try:
+            data = apply_report_edits(base_name, ops)
+        except FileNotFoundError:
+            return {"status": "error", "message": "Reporte no encontrado o sin datos guardados"}, 404
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return {"status": "error", "message": f"Operación inválida: {e}"}, 400
+
+        _autocomplete.replace_submission(base_name, data, previous)
+        _equipment.replace_submission(base_name, data)
+    _autocomplete.save(force=False)
+    _equipment.save(force=False)
+
+    # El PDF en caché ya no corresponde: regenerarlo en segundo plano
+    pdf_path = os.path.join(app.config["GENERATED_FOLDER"], base_name + ".pdf")
+    for stale in (pdf_path, pdf_path + ".pending"):
+        _remove_quietly(stale)
+    pdf_filename = schedule_pdf(data, base_name)
+    return {
+        "status": "ok",
+        "docx_file": base_name + ".docx",
+        "pdf_file": pdf_filename,
+        "applied": len(ops),
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+
+@app.route("/pdf-status/<path:filename>")
+def pdf_status(filename):
+    """Indica si el PDF en segundo plano ya está disponible"""
+    pdf_path = os.path.join(app.config["GENERATED_FOLDER"], secure_filename(filename))
+    state = pdf_state(pdf_path)
+    return {"ready": state == "ready", "failed": state == "failed"}
 
 @app.route("/generated/<path:filename>")
 def generated_files(filename):
@@ -502,8 +2453,24 @@ def health_check():
     """Health check endpoint para servicios de hosting"""
     return {"status": "ok", "message": "App is running"}
 
+@app.route("/metrics")
+def metrics():
+    """Métricas de la app en formato JSON"""
+    with _metrics_lock:
+        snapshot = json.loads(json.dumps(_metrics))
+    snapshot["admission"] = _admission.snapshot()
+    return snapshot
+
+@app.route("/ready")
+def readiness_check():
+    """Readiness: responde 200 solo cuando el precalentamiento terminó"""
+    if not _warm_state["ready"]:
+        return {"status": "warming", "ready": False}, 503
+    return {"status": "ready", "ready": True, "warmup_seconds": _warm_state["seconds"]}
+
 if __name__ == "__main__":
     ensure_dirs()
+    warmup()
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("FLASK_ENV") == "development"
     app.run(host="0.0.0.0", port=port, debug=debug)
\ No newline at end of file
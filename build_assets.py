@@ -0,0 +1,80 @@
+"""Genera los assets estáticos con hash de contenido y sus variantes precomprimidas.
+
+Uso (en el build, después de instalar dependencias):
+
+    python build_assets.py
+
+Crea static/dist/ con copias tipo `css/styles.3f2a9c1d.css`, sus versiones `.gz`
+(y `.br` si está instalado `brotli`) y `asset-manifest.json`, que la app usa para
+resolver `url_for('static', ...)` hacia los nombres con hash.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:  # Brotli es opcional: solo se generan .gz
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_NAME = "asset-manifest.json"
+
+# Directorios con assets a versionar; sw.js necesita una URL fija
+ASSET_DIRS = ("css", "js", "img")
+EXCLUDE = {"js/sw.js"}
+COMPRESSIBLE = {".css", ".js", ".svg", ".json"}
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def write_variants(dest_path, data):
+    """Escribe .gz y .br solo si realmente ahorran bytes"""
+    variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            with open(dest_path + suffix, "wb") as fh:
+                fh.write(compressed)
+
+
+def build():
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    manifest = {}
+
+    for asset_dir in ASSET_DIRS:
+        for dirpath, _, filenames in os.walk(os.path.join(STATIC_DIR, asset_dir)):
+            for filename in sorted(filenames):
+                src_path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(src_path, STATIC_DIR).replace(os.sep, "/")
+                if rel_path in EXCLUDE:
+                    continue
+                with open(src_path, "rb") as fh:
+                    data = fh.read()
+
+                stem, ext = os.path.splitext(rel_path)
+                hashed = f"dist/{stem}.{fingerprint(data)}{ext}"
+                dest_path = os.path.join(STATIC_DIR, hashed)
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                with open(dest_path, "wb") as fh:
+                    fh.write(data)
+                if ext in COMPRESSIBLE:
+                    write_variants(dest_path, data)
+                manifest[rel_path] = hashed
+                print(f"{rel_path} -> {hashed}")
+
+    with open(os.path.join(DIST_DIR, MANIFEST_NAME), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    print(f"{len(manifest)} assets en {os.path.relpath(DIST_DIR, ROOT)}")
+
+
+if __name__ == "__main__":
+    build()
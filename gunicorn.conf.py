@@ -0,0 +1,42 @@
+# Configuración de gunicorn (se carga automáticamente desde ./gunicorn.conf.py)
+#
+# Modo preload: el master importa la app, precarga la plantilla DOCX, el logo
+# y las plantillas Jinja, y luego hace fork. Los workers comparten esas páginas
+# copy-on-write y no pagan el precalentamiento en su primera petición.
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Worker con hilos: varias peticiones comparten un worker y el control de
+# admisión de la app reparte entre ellas los cupos de generación (con un solo
+# hilo síncrono nunca hay más de una petición en la app y nunca se activa)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    # Se ejecuta en el master después de cargar la app y antes del fork
+    if not preload_app:
+        return
+    from app import warmup
+
+    warmup()
+    # Mover los objetos ya creados a la generación permanente para que el GC
+    # de los workers no toque (y copie) esas páginas
+    gc.freeze()
+    server.log.info("Recursos precargados en el master")
+
+
+def post_worker_init(worker):
+    # Sin preload cada worker se calienta antes de aceptar peticiones;
+    # con preload la plantilla y los layouts ya vienen del master
+    from app import load_indexes, warmup
+
+    warmup()
+    if preload_app:
+        # Los índices del master son los del arranque: un worker recreado
+        # los recarga desde el snapshot y los JSON guardados después
+        load_indexes()
@@ -0,0 +1,267 @@
+"""Reoptimiza en bloque los DOCX ya generados.
+
+Uso:
+
+    python optimize_archive.py                     # generated/
+    python optimize_archive.py ruta/a/carpeta --jobs 4 --dpi 200
+
+Para cada reporte reduce las imágenes de word/media/ al tamaño con el que se
+muestran en el documento (más la resolución de impresión indicada), elimina las
+partes que ya no referencia ninguna relación y reempaqueta el archivo de forma
+atómica. El contenido del reporte no cambia. Los archivos ya optimizados se
+registran en .optimized.json (por hash) y se omiten en las siguientes ejecuciones.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import posixpath
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_NAME = ".optimized.json"
+
+NS = {
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+    "ct": "http://schemas.openxmlformats.org/package/2006/content-types",
+    "wp": "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing",
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+}
+R_EMBED = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
+EMU_PER_INCH = 914400
+# Solo se reescala si la imagen supera en este factor el tamaño necesario
+RESIZE_THRESHOLD = 1.25
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def rels_path(part_name):
+    """word/document.xml -> word/_rels/document.xml.rels"""
+    directory, name = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", name + ".rels")
+
+
+def read_rels(zf, part_name):
+    """Relaciones internas de una parte: {rId: parte destino}"""
+    path = rels_path(part_name)
+    if path not in zf.namelist():
+        return {}
+    base = posixpath.dirname(part_name)
+    result = {}
+    for rel in ElementTree.fromstring(zf.read(path)).findall("rel:Relationship", NS):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target")
+        if target.startswith("/"):
+            target = target.lstrip("/")
+        else:
+            target = posixpath.normpath(posixpath.join(base, target))
+        result[rel.get("Id")] = target
+    return result
+
+
+def reachable_parts(zf):
+    """Partes alcanzables desde _rels/.rels siguiendo relaciones"""
+    names = set(zf.namelist())
+    seen = set()
+    pending = list(read_rels(zf, "").values())
+    while pending:
+        part = pending.pop()
+        if part in seen or part not in names:
+            continue
+        seen.add(part)
+        pending.extend(read_rels(zf, part).values())
+    return seen
+
+
+def display_sizes(zf, parts):
+    """Tamaño máximo (EMU) con el que se muestra cada imagen en el documento"""
+    sizes = {}
+    for part in parts:
+        if not part.endswith(".xml") or not part.startswith("word/"):
+            continue
+        rels = read_rels(zf, part)
+        if not rels:
+            continue
+        root = ElementTree.fromstring(zf.read(part))
+        for drawing in root.iter():
+            if drawing.tag not in ("{%s}inline" % NS["wp"], "{%s}anchor" % NS["wp"]):
+                continue
+            extent = drawing.find("wp:extent", NS)
+            if extent is None:
+                continue
+            cx, cy = int(extent.get("cx")), int(extent.get("cy"))
+            for blip in drawing.iter("{%s}blip" % NS["a"]):
+                target = rels.get(blip.get(R_EMBED))
+                if target:
+                    prev = sizes.get(target, (0, 0))
+                    sizes[target] = (max(prev[0], cx), max(prev[1], cy))
+    return sizes
+
+
+def shrink_image(data, extent, dpi, quality):
+    """Reescala una imagen al tamaño de visualización; None si no conviene"""
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = img.format
+        if fmt not in ("JPEG", "PNG"):
+            return None
+        target = (max(1, round(extent[0] / EMU_PER_INCH * dpi)),
+                  max(1, round(extent[1] / EMU_PER_INCH * dpi)))
+        out = io.BytesIO()
+        if img.width > target[0] * RESIZE_THRESHOLD or img.height > target[1] * RESIZE_THRESHOLD:
+            if fmt == "JPEG":
+                img.draft("RGB", target)
+            img = img.resize(target, Image.LANCZOS) if img.size != target else img
+        elif fmt == "JPEG":
+            # Ya tiene el tamaño adecuado: no recomprimir con pérdida
+            return None
+        if fmt == "JPEG":
+            img.convert("RGB").save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        else:
+            img.save(out, "PNG", optimize=True)
+    result = out.getvalue()
+    return result if len(result) < len(data) else None
+
+
+def drop_overrides(content_types, removed):
+    """Quita de [Content_Types].xml los Override de partes eliminadas"""
+    ElementTree.register_namespace("", NS["ct"])
+    root = ElementTree.fromstring(content_types)
+    for override in list(root.findall("ct:Override", NS)):
+        if override.get("PartName").lstrip("/") in removed:
+            root.remove(override)
+    return ElementTree.tostring(root, xml_declaration=True, encoding="UTF-8")
+
+
+def optimize_docx(path, dpi, quality, dry_run):
+    """Optimiza un DOCX; devuelve (bytes antes, bytes después, partes eliminadas, imágenes reducidas)"""
+    before = os.path.getsize(path)
+    with zipfile.ZipFile(path) as zf:
+        reachable = reachable_parts(zf)
+        names = zf.namelist()
+        keep_rels = {rels_path(p) for p in reachable} | {"_rels/.rels"}
+        removed = {n for n in names
+                   if n != "[Content_Types].xml" and n not in reachable and n not in keep_rels}
+        sizes = display_sizes(zf, reachable)
+
+        replaced = {}
+        for part, extent in sizes.items():
+            if part.startswith("word/media/"):
+                smaller = shrink_image(zf.read(part), extent, dpi, quality)
+                if smaller:
+                    replaced[part] = smaller
+
+        if not removed and not replaced:
+            return before, before, 0, 0
+
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as out:
+            for info in zf.infolist():
+                if info.filename in removed:
+                    continue
+                data = replaced.get(info.filename)
+                if data is None:
+                    data = zf.read(info.filename)
+                    if info.filename == "[Content_Types].xml" and removed:
+                        data = drop_overrides(data, removed)
+                # Las imágenes ya están comprimidas: guardarlas sin deflate
+                compress = zipfile.ZIP_STORED if info.filename.startswith("word/media/") else zipfile.ZIP_DEFLATED
+                out.writestr(info, data, compress_type=compress)
+
+    after = len(buf.getvalue())
+    if after >= before:
+        return before, before, 0, 0
+    if not dry_run:
+        # Reemplazo atómico conservando la fecha de modificación original
+        stat = os.stat(path)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(buf.getvalue())
+        os.replace(tmp_path, path)
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+    return before, after, len(removed), len(replaced)
+
+
+def _worker(args):
+    path, dpi, quality, dry_run = args
+    try:
+        return path, optimize_docx(path, dpi, quality, dry_run), None
+    except Exception as e:  # un archivo dañado no detiene el resto
+        return path, None, str(e)
+
+
+def load_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("folder", nargs="?", default=os.path.join(ROOT, "generated"))
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--dpi", type=int, default=200, help="resolución de impresión objetivo")
+    parser.add_argument("--quality", type=int, default=85, help="calidad JPEG al recomprimir")
+    parser.add_argument("--force", action="store_true", help="ignorar el manifiesto")
+    parser.add_argument("--dry-run", action="store_true", help="solo calcular el ahorro")
+    args = parser.parse_args(argv)
+
+    manifest = {} if args.force else load_manifest(args.folder)
+    pending = []
+    hashes = {}
+    for name in sorted(os.listdir(args.folder)):
+        if not name.endswith(".docx"):
+            continue
+        path = os.path.join(args.folder, name)
+        hashes[name] = sha256_file(path)
+        if manifest.get(name) == hashes[name]:
+            continue
+        pending.append((path, args.dpi, args.quality, args.dry_run))
+
+    total_before = total_after = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        for path, result, error in pool.map(_worker, pending):
+            name = os.path.basename(path)
+            if error:
+                print(f"{name}: error ({error})")
+                continue
+            before, after, removed, resized = result
+            total_before += before
+            total_after += after
+            print(f"{name}: {before / 1024:.0f} KB -> {after / 1024:.0f} KB "
+                  f"(-{(before - after) / 1024:.0f} KB, {resized} imágenes, {removed} partes eliminadas)")
+            if not args.dry_run:
+                manifest[name] = sha256_file(path)
+
+    if not args.dry_run:
+        save_manifest(args.folder, manifest)
+    skipped = len(hashes) - len(pending)
+    print(f"Total: {total_before / 1024:.0f} KB -> {total_after / 1024:.0f} KB, "
+          f"ahorro {(total_before - total_after) / 1024:.0f} KB "
+          f"({len(pending)} procesados, {skipped} ya optimizados)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,8 +15,126 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Setup responsive behaviors
     setupResponsiveBehaviors();
+    
+    // Offline: service worker y cola de envíos
+    setupOfflineSupport();
+    
+    // Sugerencias de cliente, equipo y condiciones
+    setupAutocomplete();
 });
 
+// Autocompletado: consulta /autocomplete mientras se escribe y llena el datalist del campo
+function setupAutocomplete() {
+    const cache = {};
+    
+    const fetchSuggestions = debounce(function(input) {
+        const field = input.dataset.autocomplete;
+        const query = input.value.trim();
+        const datalist = document.getElementById(`ac-${field}`);
+        if (!datalist || !query) return;
+        
+        const key = `${field}:${query.toLowerCase()}`;
+        const fill = suggestions => {
+            datalist.innerHTML = '';
+            suggestions.forEach(text => {
+                const option = document.createElement('option');
+                option.value = text;
+                datalist.appendChild(option);
+            });
+        };
+        
+        if (cache[key]) {
+            fill(cache[key]);
+            return;
+        }
+        fetch(`/autocomplete?field=${encodeURIComponent(field)}&q=${encodeURIComponent(query)}`)
+            .then(r => r.ok ? r.json() : { suggestions: [] })
+            .then(data => {
+                cache[key] = data.suggestions;
+                fill(data.suggestions);
+            })
+            .catch(() => {});
+    }, 150);
+    
+    // Delegado: también cubre las condiciones que se agregan después
+    document.addEventListener('input', function(e) {
+        if (e.target.dataset && e.target.dataset.autocomplete) {
+            fetchSuggestions(e.target);
+        }
+    });
+}
+
+// Nuevo id de envío cada vez que se muestra el formulario (también al volver atrás),
+// así los reintentos de un mismo envío se deduplican en el servidor
+window.addEventListener('pageshow', function() {
+    const input = document.getElementById('submission_id');
+    if (input) {
+        input.value = newSubmissionId();
+    }
+    refreshDefaultDate();
+});
+
+// El formulario puede venir del cache del service worker: no dejar una fecha vieja por defecto
+function refreshDefaultDate() {
+    const fecha = document.getElementById('fecha');
+    if (!fecha || fecha.value !== fecha.defaultValue) return;
+    const now = new Date();
+    const today = new Date(now.getTime() - now.getTimezoneOffset() * 60000).toISOString().slice(0, 10);
+    if (fecha.value < today) {
+        fecha.value = today;
+    }
+}
+
+function newSubmissionId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, c => {
+        const r = Math.random() * 16 | 0;
+        return (c === 'x' ? r : (r & 0x3 | 0x8)).toString(16);
+    });
+}
+
+// Registrar el service worker y mostrar los reportes enviados desde la cola
+function setupOfflineSupport() {
+    if (!('serviceWorker' in navigator)) {
+        return;
+    }
+    
+    navigator.serviceWorker.register('/sw.js', { scope: '/' }).catch(err => {
+        console.warn('Service worker no registrado:', err);
+    });
+    
+    // Navegadores sin Background Sync: pedir el reenvío al volver la red
+    const requestReplay = () => {
+        if (navigator.onLine && navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage('replay-submissions');
+        }
+    };
+    window.addEventListener('online', requestReplay);
+    requestReplay();
+    
+    navigator.serviceWorker.addEventListener('message', function(event) {
+        const banner = document.getElementById('offline-banner');
+        if (!banner || !event.data) return;
+        
+        if (event.data.type === 'submission-replayed') {
+            const link = document.createElement('a');
+            link.href = event.data.result.docx_url;
+            link.textContent = event.data.result.docx_file;
+            const line = document.createElement('div');
+            line.append('Reporte pendiente enviado: ', link);
+            banner.appendChild(line);
+            banner.style.display = 'block';
+        } else if (event.data.type === 'submission-failed') {
+            const line = document.createElement('div');
+            line.textContent = `Un reporte pendiente fue rechazado por el servidor (${event.data.status}).`;
+            banner.appendChild(line);
+            banner.style.display = 'block';
+        }
+    });
+}
+
 // Add new condition
 function addCondition() {
     conditionCount++;
@@ -25,9 +143,11 @@ function addCondition() {
     
     // Update IDs for accessibility
     const textInput = clone.querySelector('.cond-text');
+    const categoryInput = clone.querySelector('.cond-category');
     const checkbox = clone.querySelector('.cond-checked');
     
     textInput.id = `condition-text-${conditionCount}`;
+    categoryInput.id = `condition-category-${conditionCount}`;
     checkbox.id = `condition-check-${conditionCount}`;
     
     const label = clone.querySelector('.checkbox');
@@ -164,10 +284,12 @@ function updateConditionsJSON() {
     
     conditionRows.forEach(row => {
         const text = row.querySelector('.cond-text').value.trim();
+        const category = row.querySelector('.cond-category').value.trim();
         const checked = row.querySelector('.cond-checked').checked;
         
         if (text) {
-            conditions.push({ text, checked });
+            // Sin categoría el ítem va al grupo "General" del checklist compacto
+            conditions.push(category ? { text, category, checked } : { text, checked });
         }
     });
     
@@ -188,6 +310,11 @@ function setupFormSubmission() {
             return;
         }
         
+        // La vista previa es rápida: no mostrar el overlay de generación
+        if (e.submitter && e.submitter.hasAttribute('formaction')) {
+            return;
+        }
+        
         // Show loading state
         showLoadingState();
         
@@ -200,7 +327,7 @@ function setupFormSubmission() {
     
     // Update conditions JSON when inputs change
     document.addEventListener('input', function(e) {
-        if (e.target.matches('.cond-text')) {
+        if (e.target.matches('.cond-text, .cond-category')) {
             updateConditionsJSON();
         }
     });
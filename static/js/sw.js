@@ -0,0 +1,274 @@
+// Service worker: app shell en caché y cola offline de reportes
+const SHELL_CACHE = 'shell-v3';
+const SHELL_URLS = [
+    '/',
+    '/static/js/form.js',
+    '/static/css/styles.css',
+    '/static/img/logo.png',
+    '/static/manifest.json'
+];
+
+const DB_NAME = 'reportes-offline';
+const OUTBOX = 'outbox';
+const SYNC_TAG = 'replay-submissions';
+// Reintentos ante errores del servidor (5xx) antes de descartar un envío
+const MAX_REPLAY_ATTEMPTS = 5;
+
+const ASSET_MANIFEST_URL = '/static/dist/asset-manifest.json';
+
+// Install: precache del app shell (formulario limpio, sin avisos) y de los assets con hash que usa el HTML
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(SHELL_URLS).then(() => precacheHashedAssets(cache)))
+            .then(() => self.skipWaiting())
+    );
+});
+
+async function precacheHashedAssets(cache) {
+    try {
+        const response = await fetch(ASSET_MANIFEST_URL, { cache: 'no-cache' });
+        if (!response.ok) {
+            return;
+        }
+        const manifest = await response.json();
+        await cache.addAll(Object.values(manifest).map(path => `/static/${path}`));
+    } catch (err) {
+        // Sin build de assets: solo se usan las URLs fijas
+    }
+}
+
+// Activate: limpiar versiones anteriores del cache
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(
+                keys.filter(key => key !== SHELL_CACHE).map(key => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) {
+        return;
+    }
+
+    if (request.method === 'POST' && url.pathname === '/submit') {
+        event.respondWith(submitOrQueue(request));
+        return;
+    }
+
+    if (request.method === 'GET' && url.pathname.startsWith('/static/dist/')) {
+        event.respondWith(cacheFirst(request));
+        return;
+    }
+
+    if (request.method === 'GET' && SHELL_URLS.includes(url.pathname)) {
+        event.respondWith(staleWhileRevalidate(request));
+    }
+});
+
+// Assets con hash: el contenido de una URL nunca cambia
+async function cacheFirst(request) {
+    const cache = await caches.open(SHELL_CACHE);
+    const cached = await cache.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok) {
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+// Shell: responder desde cache al instante y actualizar en segundo plano
+async function staleWhileRevalidate(request) {
+    const cache = await caches.open(SHELL_CACHE);
+    const cached = await cache.match(request);
+    const network = fetch(request)
+        .then(response => {
+            if (isCleanShell(response)) {
+                cache.put(request, response.clone());
+            }
+            return response;
+        })
+        .catch(() => cached);
+    return cached || network;
+}
+
+// Una página con avisos flash llega con Cache-Control: no-store y no reemplaza al shell
+function isCleanShell(response) {
+    return response.ok && !(response.headers.get('Cache-Control') || '').includes('no-store');
+}
+
+// Envío del formulario: si no hay red (o el servidor está saturado) se encola
+async function submitOrQueue(request) {
+    const copy = request.clone();
+    try {
+        const response = await fetch(request);
+        if (response.status !== 503) {
+            return response;
+        }
+    } catch (err) {
+        // Sin conexión: se encola abajo
+    }
+
+    await queueSubmission(copy);
+    return new Response(queuedPage(), {
+        status: 202,
+        headers: { 'Content-Type': 'text/html; charset=utf-8' }
+    });
+}
+
+async function queueSubmission(request) {
+    const formData = await request.formData();
+    const entries = [];
+    for (const [name, value] of formData.entries()) {
+        // Los File/Blob se guardan tal cual en IndexedDB
+        entries.push([name, value, value instanceof File ? value.name : null]);
+    }
+    const id = formData.get('submission_id') || String(Date.now());
+    await dbPut({ id, entries, queuedAt: Date.now(), attempts: 0 });
+
+    if (self.registration.sync) {
+        try {
+            await self.registration.sync.register(SYNC_TAG);
+        } catch (err) {
+            // Background Sync no disponible: se reintenta con el mensaje 'online'
+        }
+    }
+}
+
+// Background sync
+self.addEventListener('sync', event => {
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(replayQueue());
+    }
+});
+
+// Fallback para navegadores sin Background Sync: la página avisa al volver la red
+self.addEventListener('message', event => {
+    if (event.data === SYNC_TAG) {
+        event.waitUntil(replayQueue());
+    }
+});
+
+let replaying = null;
+
+function replayQueue() {
+    // Un solo reenvío a la vez para no duplicar peticiones
+    if (!replaying) {
+        replaying = doReplay().finally(() => { replaying = null; });
+    }
+    return replaying;
+}
+
+async function doReplay() {
+    const pending = await dbGetAll();
+    let failed = false;
+
+    for (const item of pending) {
+        const body = new FormData();
+        for (const [name, value, filename] of item.entries) {
+            if (filename !== null) {
+                body.append(name, value, filename);
+            } else {
+                body.append(name, value);
+            }
+        }
+
+        try {
+            const response = await fetch('/submit', {
+                method: 'POST',
+                body,
+                headers: { 'Accept': 'application/json' }
+            });
+            const isJson = (response.headers.get('Content-Type') || '').includes('application/json');
+            if (response.ok && isJson) {
+                const result = await response.json();
+                await dbDelete(item.id);
+                notifyClients({ type: 'submission-replayed', id: item.id, result });
+            } else if (response.ok || (response.status >= 400 && response.status < 500)) {
+                // Error definitivo (o respuesta que no es JSON): no tiene sentido reintentar
+                await dbDelete(item.id);
+                notifyClients({ type: 'submission-failed', id: item.id, status: response.status });
+            } else if (item.attempts + 1 >= MAX_REPLAY_ATTEMPTS) {
+                // El servidor sigue fallando: se descarta en vez de reintentar sin fin
+                await dbDelete(item.id);
+                notifyClients({ type: 'submission-failed', id: item.id, status: response.status });
+            } else {
+                await dbPut(Object.assign(item, { attempts: item.attempts + 1 }));
+                failed = true;
+            }
+        } catch (err) {
+            failed = true;
+        }
+    }
+
+    if (failed) {
+        // Hacer que el navegador vuelva a programar el sync
+        throw new Error('Quedan reportes pendientes de envío');
+    }
+}
+
+async function notifyClients(message) {
+    const clients = await self.clients.matchAll({ includeUncontrolled: true });
+    clients.forEach(client => client.postMessage(message));
+}
+
+function queuedPage() {
+    return `<!doctype html>
+<html lang="es">
+<head>
+  <meta charset="utf-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1">
+  <title>Reporte en cola - Navitrans</title>
+  <link rel="stylesheet" href="/static/css/styles.css">
+</head>
+<body>
+  <main class="container">
+    <div class="card">
+      <h2>Sin conexión</h2>
+      <p>El reporte y sus imágenes quedaron guardados en este dispositivo y se enviarán automáticamente cuando vuelva la conexión.</p>
+      <p><a class="btn" href="/">Volver al formulario</a></p>
+    </div>
+  </main>
+</body>
+</html>`;
+}
+
+// IndexedDB mínimo (sin dependencias)
+function openDb() {
+    return new Promise((resolve, reject) => {
+        const req = indexedDB.open(DB_NAME, 1);
+        req.onupgradeneeded = () => req.result.createObjectStore(OUTBOX, { keyPath: 'id' });
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => reject(req.error);
+    });
+}
+
+function withStore(mode, fn) {
+    return openDb().then(db => new Promise((resolve, reject) => {
+        const tx = db.transaction(OUTBOX, mode);
+        const result = fn(tx.objectStore(OUTBOX));
+        tx.oncomplete = () => resolve(result.result);
+        tx.onerror = () => reject(tx.error);
+    }));
+}
+
+function dbPut(item) {
+    // Clave = submission_id: reencolar el mismo envío lo sobrescribe
+    return withStore('readwrite', store => store.put(item));
+}
+
+function dbGetAll() {
+    return withStore('readonly', store => store.getAll());
+}
+
+function dbDelete(id) {
+    return withStore('readwrite', store => store.delete(id));
+}
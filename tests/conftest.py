@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App con carpetas de subida y generados temporales"""
+    upload_folder = tmp_path / "uploads"
+    generated_folder = tmp_path / "generated"
+    upload_folder.mkdir()
+    generated_folder.mkdir()
+    saved = {key: flask_app.config[key] for key in ("UPLOAD_FOLDER", "GENERATED_FOLDER", "TESTING")}
+    flask_app.config.update(UPLOAD_FOLDER=str(upload_folder), GENERATED_FOLDER=str(generated_folder), TESTING=True)
+    yield flask_app
+    flask_app.config.update(saved)
@@ -0,0 +1,40 @@
+"""Ranking del índice de autocompletado: frecuencia con decaimiento sobre todo el rango del prefijo"""
+import time
+
+from app import AutocompleteIndex
+
+
+def make_index(tmp_path):
+    return AutocompleteIndex(str(tmp_path / "autocomplete.json"))
+
+
+def test_frequent_entry_wins_over_alphabetical_order(tmp_path):
+    index = make_index(tmp_path)
+    ts = time.time() - 86400
+    for i in range(600):
+        index.add_submission(f"r{i}", {"cliente": f"a{i:04d}"}, ts=ts)
+    for i in range(50):
+        index.add_submission(f"p{i}", {"cliente": "azz popular"}, ts=ts)
+    assert index.suggest("cliente", "a", 3)[0] == "azz popular"
+
+
+def test_cached_top_follows_new_submissions(tmp_path):
+    index = make_index(tmp_path)
+    ts = time.time() - 30 * 86400
+    for i in range(600):
+        index.add_submission(f"r{i}", {"cliente": f"b{i:04d}"}, ts=ts)
+    assert index.suggest("cliente", "b", 1) == ["b0000"]
+    index.add_submission("nuevo", {"cliente": "Bravo Recién"}, ts=time.time())
+    assert index.suggest("cliente", "b", 1) == ["Bravo Recién"]
+
+
+def test_replaced_submission_leaves_the_top(tmp_path):
+    index = make_index(tmp_path)
+    ts = time.time()
+    for i in range(600):
+        index.add_submission(f"r{i}", {"cliente": f"c{i:04d}"}, ts=ts - 86400)
+    index.add_submission("editado", {"cliente": "Cóndor"}, ts=ts)
+    assert index.suggest("cliente", "c", 1) == ["Cóndor"]
+    index.replace_submission("editado", {"cliente": "Delta"}, {"cliente": "Cóndor"})
+    assert "Cóndor" not in index.suggest("cliente", "c", 20)
+    assert index.suggest("cliente", "d") == ["Delta"]
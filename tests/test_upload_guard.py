@@ -0,0 +1,73 @@
+"""Validación de imágenes subidas: se rechazan por cabecera y se guardan reducidas"""
+import io
+import os
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from app import ImageRejected, inspect_image, save_upload
+
+
+def png_chunk(kind, payload):
+    return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+
+def png_header(width, height):
+    """PNG válido que declara el tamaño en IHDR sin datos de píxeles reales (IDAT mínimo)"""
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", ihdr)
+            + png_chunk(b"IDAT", zlib.compress(b"")) + png_chunk(b"IEND", b""))
+
+
+def encode(size, fmt, mode="RGB"):
+    buf = io.BytesIO()
+    Image.new(mode, size).save(buf, fmt)
+    return buf.getvalue()
+
+
+def upload(data, filename):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+
+def test_header_only_png_is_read_from_the_header(app):
+    assert inspect_image(io.BytesIO(png_header(5000, 5000))) == ("PNG", (5000, 5000), "RGB")
+
+
+def test_header_only_huge_png_is_rejected(app):
+    with pytest.raises(ImageRejected, match="píxeles"):
+        inspect_image(io.BytesIO(png_header(20000, 20000)))
+
+
+@pytest.mark.filterwarnings("ignore::PIL.Image.DecompressionBombWarning")
+def test_png_over_pixel_limit_is_rejected(app):
+    with app.test_request_context():
+        with pytest.raises(ImageRejected, match="7000x7000"):
+            save_upload(upload(encode((7000, 7000), "PNG", mode="1"), "grande.png"))
+    assert os.listdir(app.config["UPLOAD_FOLDER"]) == []
+
+
+def test_non_image_with_jpg_extension_is_rejected(app):
+    with app.test_request_context():
+        with pytest.raises(ImageRejected, match="no es una imagen"):
+            save_upload(upload(b"esto no es una imagen" * 100, "foto.jpg"))
+    assert os.listdir(app.config["UPLOAD_FOLDER"]) == []
+
+
+def test_jpeg_named_png_is_saved_with_real_extension(app):
+    with app.test_request_context():
+        rel_path = save_upload(upload(encode((120, 80), "JPEG"), "foto.png"))
+    assert rel_path.endswith(".jpg")
+    with Image.open(os.path.join(app.config["UPLOAD_FOLDER"], os.path.basename(rel_path))) as img:
+        assert img.format == "JPEG"
+
+
+def test_large_jpeg_is_resized_to_max_side(app):
+    max_side = app.config["IMAGE_MAX_SIDE_PX"]
+    with app.test_request_context():
+        rel_path = save_upload(upload(encode((max_side * 3, max_side * 2), "JPEG"), "grande.jpg"))
+    with Image.open(os.path.join(app.config["UPLOAD_FOLDER"], os.path.basename(rel_path))) as img:
+        assert max(img.size) == max_side
+        assert img.size == (max_side, round(max_side * 2 / 3))